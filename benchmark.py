@@ -0,0 +1,338 @@
+# Valentin Macé
+# valentin.mace@kedgebs.com
+# Developed for fun
+# Feel free to use this code as you wish as long as you quote me as author
+
+"""
+benchmark.py
+~~~~~~~~~~
+
+Benchmarks of the hot paths of the genetic algorithm, run it with python benchmark.py
+
+Genetic operators, games, generations and the ml-agents communication layer are measured on headless stand-ins
+(BallEnv and MockCommunicator), for several population sizes, numbers of agents and network shapes.
+Results are written in a JSON file along with the commit they were measured on, so that runs of different commits
+can be compared:
+    python benchmark.py --output results.json [--quick]
+
+"""
+
+import argparse
+import contextlib
+import functools
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import unittest.mock as mock
+from mlagents_envs.ball_env import BallEnv
+from mlagents_envs.mock_communicator import MockCommunicator
+from mlagents_envs.rpc_utils import batched_step_result_from_proto
+
+from genetic_algorithm import *
+
+
+def measure(function, repeats):
+    """
+    Calls :param function :param repeats times and returns the number of calls per second
+    """
+    function()                                  # warm up (and jit compilation)
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return repeats / (time.perf_counter() - start_time)
+
+
+def benchmark_inference(shape, n_individuals=12, repeats=200):
+    """
+    Compares the inference paths on one step of a game: every individual is fed its own observation
+
+    :param shape:(list of int) Networks' shape
+    :param n_individuals:(int) Number of networks playing at the same time (agents in the env)
+    :param repeats:(int) Number of steps measured
+    :return:(dict) Steps per second for each inference path
+    """
+    population = PopulationTensor(shape, n_individuals)
+    networks = population.networks()
+    observations = np.random.randn(n_individuals, shape[0]).astype(np.float32)
+    engine = FusedInference(shape, capacity=n_individuals)
+
+    def per_network():
+        return [networks[i].feed_forward(observations[i].reshape((-1, 1))) for i in range(n_individuals)]
+
+    def batched():
+        return population.feed_forward(observations[:, :, np.newaxis])
+
+    def fused():
+        return [engine.feed_forward(population.genomes[i], observations[i]) for i in range(n_individuals)]
+
+    def fused_parallel():
+        return engine.population_feed_forward(population.genomes, observations)
+
+    return {"per_network": measure(per_network, repeats),
+            "batched": measure(batched, repeats),
+            "fused": measure(fused, repeats),
+            "fused_parallel": measure(fused_parallel, repeats)}
+
+
+def benchmark_precision(shape, n_individuals=1000, repeats=50):
+    """
+    Compares memory per individual and batched inference throughput for each precision mode
+    float16 is a storage only mode: individuals are converted to float32 before computing
+
+    :param shape:(list of int) Networks' shape
+    :param n_individuals:(int) Number of individuals
+    :param repeats:(int) Number of steps measured
+    :return:(dict) For each mode, bytes per individual and steps per second
+    """
+    observations = np.random.randn(n_individuals, shape[0], 1).astype(np.float32)
+    results = {}
+    for name, dtype in (("float64", np.float64), ("float32", np.float32), ("float16_storage", np.float16)):
+        population = PopulationTensor(shape, n_individuals, dtype)
+        if dtype == np.float16:
+            step = lambda: population.astype(np.float32).feed_forward(observations)
+        else:
+            step = lambda: population.feed_forward(observations)
+        results[name] = {"bytes_per_individual": population.genomes.nbytes / n_individuals,
+                         "steps_per_second": measure(step, repeats)}
+    return results
+
+
+class CountingBallEnv(BallEnv):
+    """ BallEnv counting its steps, to measure env steps per second """
+
+    def __init__(self, *args, **kwargs):
+        self.steps = 0
+        super().__init__(*args, **kwargs)
+
+    def step(self):
+        super().step()
+        self.steps += 1
+
+
+def make_genetic_algorithm(shape, population_size, n_agents, directory, max_steps=200, **parameters):
+    """
+    Genetic algorithm playing in a CountingBallEnv, networks of each generation are saved in :param directory
+
+    :param shape:(list of int) Networks' shape, 8 inputs and 2 outputs to play BallEnv
+    :param population_size:(int) Number of individuals
+    :param n_agents:(int) Number of agents in the env
+    :param max_steps:(int) Steps after which a game ends, bounds the duration of good networks' games
+    :return:(GeneticAlgorithm) Single process genetic algorithm, seeded
+    """
+    parameters = dict(dict(generation_number=1, dtype=np.float32, seed=0, n_episodes=1), **parameters)
+    return GeneticAlgorithm(None, networks_shape=shape, population_size=population_size,
+                            env_factory=functools.partial(CountingBallEnv, n_agents=n_agents, max_steps=max_steps),
+                            save_prefix=os.path.join(directory, "gen_"), **parameters)
+
+
+def benchmark_operators(shape, population_size, n_agents, directory, repeats=50):
+    """
+    Measures population initialization and the genetic operators making a generation's candidates
+
+    :param shape:(list of int) Networks' shape
+    :param population_size:(int) Number of individuals
+    :param n_agents:(int) Number of agents in the env
+    :param directory:(str) Where saved networks go
+    :param repeats:(int) Number of calls measured
+    :return:(dict) Calls per second of each operator
+    """
+    ga = make_genetic_algorithm(shape, population_size, n_agents, directory)
+    population = ga.population
+    population.scores[:] = ga.rng.random(len(population))
+    crossover_number = int(ga.crossover_rate*population_size)
+    mutation_number = int(ga.mutation_rate*population_size)
+    parents = ga.parent_selection(population, crossover_number, population_size)
+    results = {"population_init": measure(lambda: PopulationTensor(shape, population_size, ga.dtype), repeats),
+               "parent_selection": measure(lambda: ga.parent_selection(population, crossover_number,
+                                                                       population_size), repeats),
+               "children_production": measure(lambda: ga.children_production(population, crossover_number,
+                                                                             parents), repeats),
+               "mutation_production": measure(lambda: ga.mutation_production(population, mutation_number,
+                                                                             population_size), repeats)}
+    ga.close()
+    return results
+
+
+def benchmark_game(shape, n_agents, repeats=20, max_steps=200):
+    """
+    Measures Game.start (one game per agent) and Game.play (n_agents * 4 games packed in the agents) in BallEnv
+
+    :param shape:(list of int) Networks' shape
+    :param n_agents:(int) Number of agents in the env, i.e. of networks playing at the same time
+    :param repeats:(int) Number of calls measured
+    :param max_steps:(int) Steps after which a game ends
+    :return:(dict) Calls, games and env steps per second of each method
+    """
+    env = CountingBallEnv(n_agents=n_agents, max_steps=max_steps)
+    game = Game(env, time_scale=100.0, width=0, height=0, target_frame_rate=-1, quality_level=0)
+    population = PopulationTensor(shape, n_agents, np.float32)
+    results = {}
+    for name, function, games in (("game_start", lambda: game.start(population), n_agents),
+                                  ("game_play", lambda: game.play(population, n_rounds=4), 4 * n_agents)):
+        function()                              # warm up
+        steps, start_time = env.steps, time.perf_counter()
+        for _ in range(repeats):
+            function()
+        duration = time.perf_counter() - start_time
+        results[name] = {"calls_per_second": repeats / duration,
+                         "games_per_second": repeats * games / duration,
+                         "env_steps_per_second": (env.steps - steps) / duration}
+    env.close()
+    return results
+
+
+def benchmark_communication(n_agents, repeats=200):
+    """
+    Measures the python side of the ml-agents protocol on a UnityEnvironment talking to a MockCommunicator:
+    reading agent infos, making step inputs and whole steps
+
+    :param n_agents:(int) Number of agents sent by the communicator
+    :param repeats:(int) Number of calls measured
+    :return:(dict) Calls per second of each function
+    """
+    communicator = MockCommunicator(num_agents=n_agents)
+    with mock.patch.object(UnityEnvironment, 'executable_launcher'), \
+            mock.patch.object(UnityEnvironment, 'get_communicator', return_value=communicator):
+        env = UnityEnvironment(" ")
+    env.reset()
+    group = env.get_agent_groups()[0]
+    spec = env.get_agent_group_spec(group)
+    actions = np.zeros((n_agents, spec.action_size), dtype=np.float32)
+    agent_infos = communicator._get_agent_infos()[group].value
+
+    def step():
+        env.set_actions(group, actions)
+        env.step()
+
+    results = {"batched_step_result_from_proto": measure(lambda: batched_step_result_from_proto(agent_infos, spec),
+                                                         repeats),
+               "generate_step_input": measure(lambda: env._generate_step_input({group: actions}), repeats),
+               "env_step": measure(step, repeats)}
+    env.close()
+    return results
+
+
+def benchmark_generations(shape, population_size, n_agents, directory, generation_number=3):
+    """
+    Runs GeneticAlgorithm.start for a few generations in BallEnv
+
+    :param shape:(list of int) Networks' shape
+    :param population_size:(int) Number of individuals
+    :param n_agents:(int) Number of agents in the env
+    :param directory:(str) Where saved networks go
+    :param generation_number:(int) Number of generations measured
+    :return:(dict) Generations, evaluations and env steps per second
+    """
+    ga = make_genetic_algorithm(shape, population_size, n_agents, directory, generation_number=generation_number)
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):         # print_generation
+        ga.start()
+    duration = time.perf_counter() - start_time
+    results = {"generations_per_second": generation_number / duration,
+               "evaluations_per_second": ga.evaluation_count / duration,
+               "env_steps_per_second": ga.env.steps / duration}
+    ga.close()
+    return results
+
+
+def git_commit():
+    """
+    :return:(str) Commit of this file's repository, None if unknown
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(title, results):
+    """
+    Prints steps per second of each variant and its speed up compared to the first one
+    """
+    print(title)
+    reference = next(iter(results.values()))
+    for name, value in results.items():
+        print("    {:<16}{:>12.1f} /s   x{:.2f}".format(name, value, value / reference))
+
+
+def print_rates(title, results):
+    """
+    Prints rates (per second) of each measure, nested measures are printed on one line
+    """
+    print(title)
+    for name, value in results.items():
+        if isinstance(value, dict):
+            value = "   ".join("{} {:.1f}".format(key, rate) for key, rate in value.items())
+        else:
+            value = "{:.1f} /s".format(value)
+        print("    {:<32}{}".format(name, value))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks of the genetic algorithm's hot paths")
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON file where results are written")
+    parser.add_argument('--quick', action='store_true', help="Smaller grid and fewer repeats, for a quick check")
+    args = parser.parse_args()
+
+    shapes = ([8, 16, 2],) if args.quick else ([8, 16, 2], [8, 64, 2], [8, 64, 64, 2])
+    population_sizes = (100,) if args.quick else (100, 1000)
+    agent_numbers = (12,) if args.quick else (12, 48)
+    repeats = 1 if args.quick else 4                # multiplies the default number of calls measured
+    records = []
+
+    def record(benchmark, parameters, results):
+        records.append({"benchmark": benchmark, "parameters": parameters, "results": results})
+        print_rates("{} {}".format(benchmark, parameters), results)
+
+    """
+    Inference on the shapes used in train.py and GeneticAlgorithm,
+    for a 12 agents env and for a large batch of individuals
+    """
+    for shape in ([8, 16, 2], [21, 16, 3]):
+        for n_individuals in (12, 1000):
+            results = benchmark_inference(shape, n_individuals, repeats=2000 // n_individuals + 20)
+            print_results("Inference {} x {}".format(shape, n_individuals), results)
+            records.append({"benchmark": "inference", "parameters": {"shape": shape, "n_individuals": n_individuals},
+                            "results": results})
+
+    """
+    Memory and inference throughput of each precision mode
+    """
+    for shape in ([8, 16, 2], [21, 16, 3]):
+        results = benchmark_precision(shape)
+        print("Precision {} x 1000".format(shape))
+        for name, result in results.items():
+            print("    {:<16}{:>8.0f} bytes/individual{:>12.1f} steps/s".format(name, result["bytes_per_individual"],
+                                                                             result["steps_per_second"]))
+        records.append({"benchmark": "precision", "parameters": {"shape": shape, "n_individuals": 1000},
+                        "results": results})
+
+    """
+    Genetic operators, games, ml-agents protocol and whole generations
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        for shape in shapes:
+            for population_size in population_sizes:
+                record("operators", {"shape": shape, "population_size": population_size},
+                       benchmark_operators(shape, population_size, 12, directory, repeats=50 * repeats))
+            for n_agents in agent_numbers:
+                record("game", {"shape": shape, "n_agents": n_agents},
+                       benchmark_game(shape, n_agents, repeats=5 * repeats))
+        for n_agents in agent_numbers:
+            record("communication", {"n_agents": n_agents}, benchmark_communication(n_agents, repeats=200 * repeats))
+        for shape in shapes:
+            for population_size in population_sizes:
+                for n_agents in agent_numbers:
+                    record("generations", {"shape": shape, "population_size": population_size, "n_agents": n_agents},
+                           benchmark_generations(shape, population_size, n_agents, directory))
+
+    with open(args.output, 'w') as file:
+        json.dump({"commit": git_commit(), "time": time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   "python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(),
+                   "quick": args.quick, "records": records}, file, indent=2)
+    print("Results written to", args.output)
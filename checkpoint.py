@@ -0,0 +1,105 @@
+# Valentin Macé
+# valentin.mace@kedgebs.com
+# Developed for fun
+# Feel free to use this code as you wish as long as you quote me as author
+
+"""
+checkpoint.py
+~~~~~~~~~~
+
+A module to save and resume the whole state of a genetic algorithm
+
+A checkpoint is a single file: a magic string, the length of a JSON header, the header (generation counter, history,
+random generator state, where each array is) and raw arrays aligned on 64 bytes, so they can be memory-mapped
+
+Checkpoints are written with writer.atomic_write, on a background thread by a CheckpointWriter
+
+"""
+
+import json
+import numpy as np
+
+from writer import *
+
+MAGIC = b'GUCKPT01'
+ALIGNMENT = 64
+
+
+def aligned(offset):
+    """
+    :return:(int) First multiple of ALIGNMENT from :param offset
+    """
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def save_checkpoint(path, arrays, metadata):
+    """
+    Writes a checkpoint, a temporary file replaces the previous checkpoint only once complete
+
+    :param path:(str) Checkpoint file
+    :param arrays:(dict) Name -> np.ndarray
+    :param metadata:(dict) JSON serializable data
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+        offset = aligned(offset + array.nbytes)
+    header = json.dumps({'metadata': metadata, 'arrays': layout}).encode()
+    data_start = aligned(len(MAGIC) + 8 + len(header))
+    with atomic_write(path, 'wb') as file:
+        file.write(MAGIC + len(header).to_bytes(8, 'little') + header)
+        for name, array in arrays.items():
+            file.seek(data_start + layout[name]['offset'])
+            file.write(memoryview(array).cast('B'))
+        file.truncate(data_start + offset)
+
+
+def load_checkpoint(path, mmap=True):
+    """
+    Reads a checkpoint
+
+    :param path:(str) Checkpoint file
+    :param mmap:(bool) Maps arrays instead of reading them (copy-on-write, the file is never modified)
+    :return:(tuple) Arrays (dict) and metadata (dict)
+    """
+    with open(path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(path + " is not a checkpoint")
+        header_size = int.from_bytes(file.read(8), 'little')
+        header = json.loads(file.read(header_size).decode())
+        data_start = aligned(len(MAGIC) + 8 + header_size)
+        arrays = {}
+        for name, entry in header['arrays'].items():
+            dtype, shape = np.dtype(entry['dtype']), tuple(entry['shape'])
+            if mmap and int(np.prod(shape)) > 0:
+                arrays[name] = np.memmap(file, dtype=dtype, mode='c', offset=data_start + entry['offset'],
+                                         shape=shape)
+            else:
+                file.seek(data_start + entry['offset'])
+                arrays[name] = np.fromfile(file, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+    return arrays, header['metadata']
+
+
+class CheckpointWriter(BackgroundWriter):
+    """ Checkpoint Writer class
+
+    Writes checkpoints on a background thread (see writer.BackgroundWriter).
+    Arrays are copied when a checkpoint is requested, if a checkpoint is still waiting to be written when another
+    one is requested, only the latest one is written.
+
+    """
+
+    def __init__(self):
+        super().__init__(keep_latest=True)
+
+    def write(self, path, arrays, metadata):
+        """
+        Requests a checkpoint and returns without waiting for it, see save_checkpoint
+        """
+        arrays = {name: np.array(array, copy=True) for name, array in arrays.items()}     # snapshot
+        self.put((path, arrays, metadata))
+
+    def write_item(self, item):
+        save_checkpoint(*item)
@@ -12,6 +12,7 @@ A module to implement all crossover routines used in a genetic algorithm
 """
 
 import copy
+import numpy as np
 from random import randint
 
 from game import *
@@ -47,7 +48,7 @@ def crossover(env, parent1, parent2, crossover_method):
     else:  # crossover over bias
         bias_crossover(net1, net2)
 
-    game = Game(unity_env=env, time_scale=100.0, width=0, height=0, target_frame_rate=-1, quality_level=0)
+    game = Game.session(unity_env=env, time_scale=100.0, width=0, height=0, target_frame_rate=-1, quality_level=0)
     score1 = game.start([net1])
     score2 = game.start([net2])
     if score1 > score2:
@@ -94,8 +95,8 @@ def layer_crossover(net1, net2):
     """
     layer = randint(0, len(net1.weights) - 1)  # random layer
     temp = copy.deepcopy(net1)  # switching layers
-    net1.weights[layer] = net2.weights[layer]
-    net2.weights[layer] = temp.weights[layer]
+    net1.weights[layer][...] = net2.weights[layer]   # copying values, weights may be views into a genome
+    net2.weights[layer][...] = temp.weights[layer]
 
 
 def bias_crossover(net1, net2):
@@ -110,3 +111,130 @@ def bias_crossover(net1, net2):
     temp = copy.deepcopy(net1)  # switching biases
     net1.biases[layer][bias] = net2.biases[layer][bias]
     net2.biases[layer][bias] = temp.biases[layer][bias]
+
+
+def batch_crossover(population, parents1, parents2, crossover_method, rng=None):
+    """
+    Batch version of crossover, produces the two candidate children of every pair of parents at once
+    No game is played here: candidates are meant to be evaluated with the rest of the generation,
+    then crossover_winners keeps the best candidate of each pair (as crossover does after its two games)
+
+    :param population:(PopulationTensor) Population the parents come from
+    :param parents1:(array of int) Indices of the first parents
+    :param parents2:(array of int) Indices of the second parents
+    :param crossover_method:(str) to apply crossover over a single weight, a neuron or an entire layer
+    :param rng:(np.random.Generator) Random generator to use
+    :return:(PopulationTensor) 2n candidates, candidates[i] and candidates[n+i] are the copies of parents1[i] and
+    parents2[i] after switching a weight, neuron, layer or bias between them
+    """
+    rng = rng or np.random.default_rng()
+    n = len(parents1)
+    candidates = population.take(np.concatenate((parents1, parents2)))   # copies, otherwise we manipulate parents
+    candidates.stale[:] = True
+    first = np.arange(n)
+    second = first + n
+    on_biases = rng.integers(0, 2, n).astype(bool)      # weights or biases, for each pair
+    if crossover_method == 'weight':
+        batch_weight_crossover(candidates, first[~on_biases], second[~on_biases], rng)
+    elif crossover_method == 'neuron':
+        batch_neuron_crossover(candidates, first[~on_biases], second[~on_biases], rng)
+    elif crossover_method == 'layer':
+        batch_layer_crossover(candidates, first[~on_biases], second[~on_biases], rng)
+    batch_bias_crossover(candidates, first[on_biases], second[on_biases], rng)
+    return candidates
+
+
+def crossover_winners(scores, n):
+    """
+    Picks the best candidate of each pair produced by batch_crossover, the second one on ties as crossover does
+
+    :param scores:(np.ndarray) (2n,) scores of the candidates
+    :param n:(int) Number of pairs
+    :return:(np.ndarray) (n,) indices of the winning candidates
+    """
+    first = np.arange(n)
+    return np.where(scores[:n] > scores[n:2 * n], first, first + n)
+
+
+def batch_weight_crossover(population, first, second, rng=None):
+    """
+    Switches a single random weight between population[first[i]] and population[second[i]], for every i
+
+    :param population:(PopulationTensor) Population modified in place
+    :param first:(array of int) First individual of each pair
+    :param second:(array of int) Second individual of each pair
+    :param rng:(np.random.Generator) Random generator to use
+    """
+    rng = rng or np.random.default_rng()
+    layers = rng.integers(0, population.depth, len(first))     # random layer for each pair
+    for layer in range(population.depth):
+        selected = layers == layer
+        a, b = first[selected], second[selected]
+        weights = population.weights[layer]
+        neurons = rng.integers(0, weights.shape[1], len(a))     # random neuron
+        inputs = rng.integers(0, weights.shape[2], len(a))      # random weight
+        temp = weights[a, neurons, inputs]                      # switching weights
+        weights[a, neurons, inputs] = weights[b, neurons, inputs]
+        weights[b, neurons, inputs] = temp
+
+
+def batch_neuron_crossover(population, first, second, rng=None):
+    """
+    Switches a random neuron between population[first[i]] and population[second[i]], for every i
+
+    :param population:(PopulationTensor) Population modified in place
+    :param first:(array of int) First individual of each pair
+    :param second:(array of int) Second individual of each pair
+    :param rng:(np.random.Generator) Random generator to use
+    """
+    rng = rng or np.random.default_rng()
+    layers = rng.integers(0, population.depth, len(first))
+    for layer in range(population.depth):
+        selected = layers == layer
+        a, b = first[selected], second[selected]
+        weights = population.weights[layer]
+        neurons = rng.integers(0, weights.shape[1], len(a))
+        temp = weights[a, neurons]                              # switching neurons
+        weights[a, neurons] = weights[b, neurons]
+        weights[b, neurons] = temp
+
+
+def batch_layer_crossover(population, first, second, rng=None):
+    """
+    Switches a whole random layer between population[first[i]] and population[second[i]], for every i
+
+    :param population:(PopulationTensor) Population modified in place
+    :param first:(array of int) First individual of each pair
+    :param second:(array of int) Second individual of each pair
+    :param rng:(np.random.Generator) Random generator to use
+    """
+    rng = rng or np.random.default_rng()
+    layers = rng.integers(0, population.depth, len(first))
+    for layer in range(population.depth):
+        selected = layers == layer
+        a, b = first[selected], second[selected]
+        weights = population.weights[layer]
+        temp = weights[a]                                       # switching layers
+        weights[a] = weights[b]
+        weights[b] = temp
+
+
+def batch_bias_crossover(population, first, second, rng=None):
+    """
+    Switches a single random bias between population[first[i]] and population[second[i]], for every i
+
+    :param population:(PopulationTensor) Population modified in place
+    :param first:(array of int) First individual of each pair
+    :param second:(array of int) Second individual of each pair
+    :param rng:(np.random.Generator) Random generator to use
+    """
+    rng = rng or np.random.default_rng()
+    layers = rng.integers(0, population.depth, len(first))
+    for layer in range(population.depth):
+        selected = layers == layer
+        a, b = first[selected], second[selected]
+        biases = population.biases[layer]
+        neurons = rng.integers(0, biases.shape[1], len(a))      # random bias
+        temp = biases[a, neurons, 0]                            # switching biases
+        biases[a, neurons, 0] = biases[b, neurons, 0]
+        biases[b, neurons, 0] = temp
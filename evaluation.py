@@ -11,76 +11,491 @@ A module to implement all evaluation routines used in a genetic algorithm
 
 """
 
+import hashlib
 import multiprocessing as mp
+import os
+import queue
+import time
+import traceback
+from collections import OrderedDict
+from multiprocessing import resource_tracker, shared_memory
 import numpy as np
 from mlagents_envs.environment import UnityEnvironment
+from mlagents_envs.timers import get_timer_root, hierarchical_timer, reset_timers
 
 from game import *
 
 
-def single_process_evaluation(env, networks, n_agents):
+def single_process_evaluation(env, networks, n_episodes=4):
     """
-    Evaluate all networks over 4 games
+    Evaluate all networks over :param n_episodes games, episodes of different networks run concurrently in the
+    agents of the env (see Game.play)
 
     :param env:(UnityEnvironment) Environment where evaluation games will be played
-    :param networks:(list of NeuralNetwork) Neural nets to be evaluated
-    :param n_agents:(int) Number of agents in env, so we can pass multiple NeuralNetwork
-    :return:(list of float) Scores for each NeuralNetwork
+    :param networks:(list of NeuralNetwork or PopulationTensor) Neural nets to be evaluated
+    :param n_episodes:(int) Number of games played by each network
+    :return:(np.ndarray) Scores of shape (number of networks, n_episodes), see aggregate_scores
 
-    Todo: Randomize env seed, average results here before return
+    Todo: Randomize env seed
     """
-    game = Game(unity_env=env, time_scale=100.0, width=0, height=0, target_frame_rate=-1, quality_level=0)
-    results = []
-    for _ in range(4):
-        sub_results = []
-        for i in range(0, len(networks), n_agents):
-            sub_results += game.start(networks[i:i + n_agents])
-        results.append(sub_results)
-    return results
+    game = Game.session(unity_env=env, time_scale=100.0, width=0, height=0, target_frame_rate=-1, quality_level=0)
+    return np.transpose(game.play(networks, n_episodes))
 
 
-def multi_process_evaluation(networks, env_name, n_process, n_agents):
+def aggregate_scores(results, aggregation='mean', quantile=0.25):
     """
-    Manages evaluation of all networks over multiple process
+    Reduces the scores of all episodes to a single fitness per network
 
-    :param networks:(list of NeuralNetwork) Neural nets to be evaluated
-    :param env_name:(str) Path to built unity game
-    :param n_process:(int) Number of process needed for parallelization
-    :param n_agents:(int) Number of agents in the env, so we can pass multiple NeuralNetwork
-    :return:(list of float) Scores for each NeuralNetwork
+    :param results:(np.ndarray) Scores of shape (number of networks, number of episodes)
+    :param aggregation:(str) 'mean', 'min' (worst episode) or 'quantile'
+    :param quantile:(float) Quantile of the episodes scores used by the 'quantile' aggregation
+    :return:(np.ndarray) Fitness of each network
+    """
+    results = np.asarray(results, dtype=np.float64)
+    if aggregation == 'mean':
+        return results.mean(axis=1)
+    if aggregation == 'min':
+        return results.min(axis=1)
+    if aggregation == 'quantile':
+        return np.quantile(results, quantile, axis=1)
+    raise ValueError("Unknown aggregation: " + str(aggregation))
+
+
+class UnityEnvFactory:
+    """ Unity Env Factory class
+
+    Picklable callable building the UnityEnvironment of an evaluation worker,
+    any callable with the same signature returning a BaseEnv can be used instead
 
-    Todo: Optimize, write clearer code
     """
-    queue = mp.Queue()
-    split_networks = np.array_split(networks, n_process)
-    jobs = [mp.Process(target=multi_process_evaluation_job, args=(queue, split_networks[i], env_name, i, n_agents))
-            for i in range(n_process)]
-    for job in jobs: job.start()
-    sub_results = [queue.get() for _ in range(n_process)]
-    for job in jobs: job.join()
-    sub_results.sort(key=lambda tup: tup[0])
-    results = []
-    for sub_result in sub_results: results += np.mean(sub_result[1], axis=0).tolist()
-    return results
-
-
-def multi_process_evaluation_job(queue, networks, env_name, worker, n_agents):
+
+    def __init__(self, file_name, base_port=5006, no_graphics=True):
+        """
+        :param file_name:(str) Path to built unity game
+        :param base_port:(int) Port of the first env, worker_id is added to it
+        :param no_graphics:(bool) Whether to run the Unity simulator in no-graphics mode
+        """
+        self.file_name = file_name
+        self.base_port = base_port
+        self.no_graphics = no_graphics
+
+    def __call__(self, worker_id=0, seed=0):
+        """
+        :param worker_id:(int) Added to base_port, each env needs its own
+        :param seed:(int) Seed of the env
+        :return:(UnityEnvironment) A new env
+        """
+        return UnityEnvironment(base_port=self.base_port, worker_id=worker_id, file_name=self.file_name, seed=seed,
+                                no_graphics=self.no_graphics)
+
+
+class SharedArray:
+    """ Shared Array class
+
+    numpy array living in a multiprocessing.shared_memory block, other processes attach it by name (zero-copy)
+
     """
-    Single process evaluating its neural networks
 
-    :param queue:(multiprocessing.Queue) Where to put results for the parent process
-    :param networks:(list of NeuralNetwork) Neural nets to be evaluated
-    :param env_name:(str) Path to built unity game
-    :param worker:(int) Will be added to base_port, in order to use another port than existing UnityEnvironment
-    :param n_agents:(int) Number of agents in the env, so we can pass multiple NeuralNetwork
+    def __init__(self, shape, dtype, name=None):
+        """ Creates the block, or attaches an existing one when :param name is given
+
+        :param shape:(tuple of int) Shape of the array
+        :param dtype:(np.dtype) Dtype of the array
+        :param name:(str) Name of the block to attach
+        """
+        size = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf)
+
+    def descriptor(self):
+        """
+        :return:(tuple) (name, shape, dtype), what another process needs to attach the array
+        """
+        return self.shm.name, self.array.shape, self.array.dtype.str
+
+    @classmethod
+    def attach(cls, descriptor):
+        """
+        :param descriptor:(tuple) Given by SharedArray.descriptor
+        :return:(SharedArray) The array, attached in the current process
+        """
+        name, shape, dtype = descriptor
+        return cls(shape, dtype, name=name)
+
+    def close(self):
+        """
+        Detaches the block, and frees it if it was created by this process
+        """
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class EvaluationPool:
+    """ Evaluation Pool class
+
+    Persistent pool of evaluation processes: each worker starts its env once and keeps it open for the whole run,
+    receiving work over a queue instead of booting a new Unity player every generation.
+    Genomes are written once in a shared memory block that workers read zero-copy, tasks only carry index ranges
+    and workers write scores in a shared result array, so nothing proportional to the population is pickled.
+    Work is scheduled dynamically: the population is cut in small batches that free workers pull from a common queue,
+    so fast workers take over the tail of slow ones, self.utilization tells how busy each worker was.
+    Evaluations can also be asynchronous (see open_slots, submit and collect), for steady-state algorithms.
+    Use close() (or a with statement) to shut workers and their envs down.
+    Other algorithms can run their own worker loop (see worker_loop) in the pool, using its queues directly.
+
     """
-    env = UnityEnvironment(base_port=5006, worker_id=worker+1, file_name=env_name, seed=np.random.randint(0,100), no_graphics=True)
-    game = Game(unity_env=env, time_scale=100.0, width=0, height=0, target_frame_rate=-1, quality_level=0)
-    results = []
-    for _ in range(4):
-        sub_results = []
-        for i in range(0, len(networks), n_agents):
-            sub_results += game.start(networks[i:i + n_agents])
-        results.append(sub_results)
-    queue.put((worker, results))
-    env.close()
+
+    def __init__(self, env_factory, n_process, first_worker_id=1, worker=None, worker_args=(), fused_inference=False):
+        """ Starts the workers
+
+        :param env_factory:(callable) Called as env_factory(worker_id=..., seed=...) in each worker to build its env
+        :param n_process:(int) Number of worker processes
+        :param first_worker_id:(int) worker_id of the first worker's env, the next ones follow
+        :param worker:(callable) Function run by each worker process, evaluation_worker by default, called as
+        worker(tasks, results, env_factory, worker_id, index, fused_inference, *worker_args)
+        :param worker_args:(tuple) Additional arguments of worker
+        :param fused_inference:(bool) Workers run networks with the compiled FusedInference engine (see Game)
+        """
+        if os.name == 'posix':      # workers share this tracker, it won't unlink blocks they attached when they exit
+            resource_tracker.ensure_running()
+        self.n_process = n_process
+        self.genomes = None         # SharedArray of genomes, grown when needed
+        self.scores = None          # SharedArray of scores, one column per episode
+        self.utilization = np.zeros(n_process)     # busy time / wall time of each worker during the last evaluation
+        self.tasks_done = np.zeros(n_process, dtype=int)
+        self.resets = 0             # env resets made by all workers
+        self.steps = 0              # env steps made by all workers
+        self.free_slots = []        # slots of the shared blocks available to submit, see open_slots
+        self.slot_size = 0
+        self.slot_lengths = {}      # number of networks submitted in each pending slot
+        self.busy = np.zeros(n_process)     # busy time of each worker since open_slots
+        self.slots_opened = 0.0
+        self.tasks = mp.Queue()
+        self.results = mp.Queue()
+        self.workers = [mp.Process(target=worker or evaluation_worker, daemon=True,
+                                   args=(self.tasks, self.results, env_factory, first_worker_id + i, i,
+                                         fused_inference) + worker_args)
+                        for i in range(n_process)]
+        for worker in self.workers:
+            worker.start()
+
+    def reserve(self, n, n_params, dtype, n_episodes):
+        """
+        Makes sure shared blocks can hold :param n genomes and their scores, reallocating them if needed
+        """
+        if (self.genomes is None or len(self.genomes.array) < n or self.genomes.array.shape[1] != n_params
+                or self.genomes.array.dtype != dtype or self.scores.array.shape[1] != n_episodes):
+            capacity = max(n, int(1.5 * len(self.genomes.array)) if self.genomes is not None else n)
+            self.release()
+            self.genomes = SharedArray((capacity, n_params), dtype)
+            self.scores = SharedArray((capacity, n_episodes), np.float64)
+
+    def next_result(self, poll_interval=1.0):
+        """
+        Waits for the next result of a worker, checking every :param poll_interval seconds that all workers are still
+        alive, so that a crashed env or a killed worker raises instead of blocking the run forever
+
+        :return:(tuple) Result put by a worker, see evaluation_worker
+        """
+        while True:
+            try:
+                return self.results.get(timeout=poll_interval)
+            except queue.Empty:
+                for worker in self.workers:
+                    if not worker.is_alive():
+                        raise RuntimeError("Evaluation worker " + worker.name + " died, exit code "
+                                           + str(worker.exitcode))
+
+    def evaluate(self, population, n_episodes=4, batch_size=None):
+        """
+        Cuts the population in batches handed out to whichever worker is free, and waits for all scores
+        When there are fewer batches than workers, the episodes of each batch are also split so that they are played
+        concurrently by several workers, i.e. in envs with different seeds
+
+        :param population:(PopulationTensor) Neural nets to be evaluated
+        :param n_episodes:(int) Number of games played by each network
+        :param batch_size:(int) Number of networks per batch, typically the number of agents in an env,
+        an even split between workers by default
+        :return:(np.ndarray) Scores of shape (number of networks, n_episodes), see aggregate_scores
+        """
+        n = len(population)
+        self.reserve(n, population.genomes.shape[1], population.dtype, n_episodes)
+        self.genomes.array[:n] = population.genomes             # a single copy into shared memory
+        genomes, scores = self.genomes.descriptor(), self.scores.descriptor()
+        batch_size = batch_size or -(-n // self.n_process)
+        n_batches = -(-n // batch_size)
+        n_splits = min(n_episodes, max(1, -(-self.n_process // max(n_batches, 1))))    # episode chunks per batch
+        episode_bounds = np.linspace(0, n_episodes, n_splits + 1).astype(int)
+        start_time = time.perf_counter()
+        n_tasks = 0
+        for start in range(0, n, batch_size):
+            for i in range(n_splits):
+                self.tasks.put((None, start, min(start + batch_size, n), episode_bounds[i], episode_bounds[i + 1],
+                                population.shape, genomes, scores))
+                n_tasks += 1
+        busy = np.zeros(self.n_process)
+        errors = []
+        with hierarchical_timer("workers") as workers_timer:
+            for _ in range(n_tasks):                # all results are collected, even after a failure
+                worker, busy_time, _, resets, steps, timer_root, error = self.next_result()
+                self.resets += resets
+                self.steps += steps
+                workers_timer.merge(timer_root, root_name="worker_root", is_parallel=True)
+                busy[worker] += busy_time
+                self.tasks_done[worker] += 1
+                if error is not None:
+                    errors.append(error)
+        self.utilization = busy / max(time.perf_counter() - start_time, 1e-9)
+        if errors:
+            raise RuntimeError("Evaluation worker failed:\n" + errors[0])
+        return self.scores.array[:n].copy()
+
+    def open_slots(self, n_slots, slot_size, n_params, dtype, n_episodes=4):
+        """
+        Prepares asynchronous evaluations: shared blocks are cut in :param n_slots slots of :param slot_size genomes,
+        each submitted population takes a slot until it is collected
+        Note: evaluate must not be called while submitted populations are pending
+        """
+        self.reserve(n_slots * slot_size, n_params, dtype, n_episodes)
+        self.free_slots = list(range(n_slots))
+        self.slot_size = slot_size
+        self.slot_lengths = {}
+        self.busy = np.zeros(self.n_process)
+        self.slots_opened = time.perf_counter()
+
+    def submit(self, population):
+        """
+        Queues the evaluation of a small population and returns without waiting, see collect
+
+        :param population:(PopulationTensor) At most slot_size neural nets to be evaluated
+        :return:(int) Ticket of this evaluation, given back by collect
+        """
+        if not self.free_slots or len(population) > self.slot_size:
+            raise RuntimeError("No free slot for " + str(len(population)) + " networks, see open_slots")
+        slot = self.free_slots.pop()
+        self.slot_lengths[slot] = len(population)
+        start = slot * self.slot_size
+        self.genomes.array[start:start + len(population)] = population.genomes
+        self.tasks.put((slot, start, start + len(population), 0, self.scores.array.shape[1], population.shape,
+                        self.genomes.descriptor(), self.scores.descriptor()))
+        return slot
+
+    def collect(self):
+        """
+        Waits for the next submitted evaluation to be done, whichever it is
+
+        :return:(tuple) Ticket and scores of shape (number of networks, number of episodes)
+        """
+        with hierarchical_timer("workers") as workers_timer:
+            worker, busy_time, slot, resets, steps, timer_root, error = self.next_result()
+            workers_timer.merge(timer_root, root_name="worker_root", is_parallel=True)
+        self.resets += resets
+        self.steps += steps
+        self.tasks_done[worker] += 1
+        self.busy[worker] += busy_time
+        self.utilization = self.busy / max(time.perf_counter() - self.slots_opened, 1e-9)
+        self.free_slots.append(slot)
+        n = self.slot_lengths.pop(slot)
+        if error is not None:
+            raise RuntimeError("Evaluation worker failed:\n" + error)
+        start = slot * self.slot_size
+        return slot, self.scores.array[start:start + n].copy()
+
+    def release(self):
+        """
+        Frees shared blocks
+        """
+        for block in (self.genomes, self.scores):
+            if block is not None:
+                block.close()
+        self.genomes = None
+        self.scores = None
+
+    def close(self):
+        """
+        Stops all workers, each one closes its env, and frees shared blocks
+        """
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join(timeout=30)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = []
+        self.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def worker_loop(tasks, env_factory, worker_id, handle, fused_inference=False):
+    """
+    Loop of a pool worker: builds its env and the env's Game, then handles tasks until it receives None,
+    the env is closed at the end
+
+    :param tasks:(multiprocessing.Queue) Tasks of the pool
+    :param env_factory:(callable) Builds the env of this worker
+    :param worker_id:(int) Given to env_factory, it is also the seed of the env
+    :param handle:(callable) Called as handle(game, task) for each task
+    :param fused_inference:(bool) The Game runs networks with the compiled FusedInference engine
+    """
+    env = env_factory(worker_id=worker_id, seed=worker_id)
+    try:
+        game = Game.session(unity_env=env, time_scale=100.0, width=0, height=0, target_frame_rate=-1, quality_level=0,
+                            fused_inference=fused_inference)
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            handle(game, task)
+    finally:
+        env.close()
+
+
+def evaluation_worker(tasks, results, env_factory, worker_id, index, fused_inference=False):
+    """
+    Loop of a worker of an EvaluationPool: evaluates ranges of the shared genomes until it receives None
+
+    :param tasks:(multiprocessing.Queue) (tag, start, stop, first episode, last episode, shape, genomes, scores)
+    tuples where genomes and scores are SharedArray descriptors
+    :param results:(multiprocessing.Queue) Where (index, busy time, tag, env resets, env steps, timer root, None) is
+    put when scores are written, (index, busy time, tag, env resets, env steps, timer root, traceback) on failure,
+    the timer root holds the hierarchical timers of the task (merged in the timer tree of the pool's process)
+    :param env_factory:(callable) Builds the env of this worker
+    :param worker_id:(int) Given to env_factory, it is also the seed of the env
+    :param index:(int) Index of the worker in the pool
+    :param fused_inference:(bool) See worker_loop
+    """
+    attached = {}           # descriptor -> SharedArray, blocks are attached once
+
+    def handle(game, task):
+        nonlocal attached
+        resets, steps = game.resets, game.steps
+        reset_timers()
+        tag, start, stop, first_episode, last_episode, shape, genomes, scores = task
+        start_time = time.perf_counter()
+        try:
+            if genomes not in attached or scores not in attached:
+                for block in attached.values():         # the pool reallocated its blocks
+                    block.close()
+                attached = {genomes: SharedArray.attach(genomes), scores: SharedArray.attach(scores)}
+            population = PopulationTensor.from_genomes(shape, attached[genomes].array[start:stop])
+            results_episodes = game.play(population, last_episode - first_episode)
+            attached[scores].array[start:stop, first_episode:last_episode] = np.transpose(results_episodes)
+            results.put((index, time.perf_counter() - start_time, tag, game.resets - resets,
+                         game.steps - steps, get_timer_root(), None))
+        except Exception:
+            results.put((index, time.perf_counter() - start_time, tag, game.resets - resets,
+                         game.steps - steps, get_timer_root(), traceback.format_exc()))
+
+    try:
+        worker_loop(tasks, env_factory, worker_id, handle, fused_inference)
+    finally:
+        for block in attached.values():
+            block.close()
+
+
+class FitnessCache:
+    """ Fitness Cache class
+
+    Remembers the scores of already evaluated genomes, so that unchanged individuals (survivors of previous
+    generations) do not play their games again.
+    Keys are a content hash of the genome and of the evaluation seeds, least recently used entries are evicted first.
+    A cached score can still be re-sampled at a given rate, the new games are then averaged with the previous ones.
+
+    """
+
+    def __init__(self, max_size=100000, resample_rate=0.0, seeds=(0,), rng=None):
+        """ Initializes the cache
+
+        :param max_size:(int) Maximum number of genomes remembered
+        :param resample_rate:(float) Probability for a cached genome to be evaluated again anyway
+        :param seeds:(tuple of int) Seeds of the evaluation envs, scores obtained with other seeds are not reused
+        :param rng:(np.random.Generator) Random generator used for re-sampling
+        """
+        self.max_size = max_size
+        self.resample_rate = resample_rate
+        self.rng = rng or np.random.default_rng()
+        self.entries = OrderedDict()        # key -> (mean score, number of evaluations), oldest first
+        self.hits = 0
+        self.misses = 0
+        self.resamples = 0
+        self.set_seeds(seeds)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def set_seeds(self, seeds):
+        """
+        Changes the evaluation seeds, previously cached scores won't be hit anymore
+        """
+        self.salt = np.asarray(seeds, dtype=np.int64).tobytes()
+
+    def keys(self, genomes):
+        """
+        :param genomes:(np.ndarray) (P, n) stacked genomes
+        :return:(list of bytes) Content hash of each genome (and of the evaluation seeds)
+        """
+        genomes = np.ascontiguousarray(genomes)
+        keys = []
+        for genome in genomes:
+            h = hashlib.blake2b(self.salt, digest_size=16)
+            h.update(genome)
+            keys.append(h.digest())
+        return keys
+
+    def lookup(self, keys):
+        """
+        Looks genomes up in the cache
+
+        :param keys:(list of bytes) Keys given by FitnessCache.keys
+        :return:(np.ndarray, np.ndarray) (P,) cached scores (nan when missing) and (P,) booleans telling which
+        genomes must be evaluated (missing or re-sampled)
+        """
+        scores = np.full(len(keys), np.nan)
+        missing = np.ones(len(keys), dtype=bool)
+        resample = self.rng.random(len(keys)) < self.resample_rate
+        for i, key in enumerate(keys):
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                continue
+            self.entries.move_to_end(key)           # most recently used
+            scores[i] = entry[0]
+            if resample[i]:
+                self.resamples += 1
+            else:
+                self.hits += 1
+                missing[i] = False
+        return scores, missing
+
+    def store(self, keys, scores):
+        """
+        Stores new scores, averaged with the cached ones for re-sampled genomes
+
+        :param keys:(list of bytes) Keys given by FitnessCache.keys
+        :param scores:(np.ndarray) (P,) new scores
+        :return:(np.ndarray) (P,) scores now cached for these genomes
+        """
+        stored = np.empty(len(keys))
+        for i, (key, score) in enumerate(zip(keys, scores)):
+            mean, count = self.entries.pop(key, (0.0, 0))
+            mean = (mean * count + score) / (count + 1)
+            self.entries[key] = (mean, count + 1)
+            stored[i] = mean
+        while len(self.entries) > self.max_size:        # evicting least recently used genomes
+            self.entries.popitem(last=False)
+        return stored
+
+    def hit_rate(self):
+        """
+        :return:(float) Proportion of lookups answered by the cache
+        """
+        lookups = self.hits + self.misses + self.resamples
+        return self.hits / lookups if lookups else 0.0
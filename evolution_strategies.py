@@ -0,0 +1,260 @@
+# Valentin Macé
+# valentin.mace@kedgebs.com
+# Developed for fun
+# Feel free to use this code as you wish as long as you quote me as author
+
+"""
+evolution_strategies.py
+~~~~~~~~~~
+
+A module to implement evolution strategies (OpenAI-ES style) to train neural networks in a Unity Environment
+
+A single parameter vector is improved at each iteration: workers play mirrored perturbations of it and the update is
+a rank-weighted sum of the perturbations. Perturbations are slices of a noise table shared by all processes, so they
+are designated by their offset in the table (the seed) and only (offset, score) pairs are sent between processes.
+
+"""
+
+import pickle
+import time
+import traceback
+import numpy as np
+
+from evaluation import *
+
+
+class EvolutionStrategies:
+    """ Evolution Strategies Class """
+
+    def __init__(self, unity_env_name, network=None, networks_shape=None, population_size=100, iteration_number=100,
+                 sigma=0.05, learning_rate=0.1, weight_decay=0.005, noise_size=2**24, n_process=1, n_episodes=1,
+                 dtype=np.float32, seed=None, env_factory=None, fused_inference=False):
+        """ Initializes evolution strategies
+
+        :param unity_env_name(str): Path to built unity game
+        :param network(NeuralNetwork): Starting point, a random network by default
+        :param networks_shape(list of int): List defining number of layers and number of neurons in each layer
+        :param population_size(int): Number of perturbations played at each iteration, half of them mirror the others
+        :param iteration_number(int): How many updates the algorithm will make
+        :param sigma(float): Standard deviation of the perturbations
+        :param learning_rate(float): Step size of the updates
+        :param weight_decay(float): Pulls the parameters towards 0 at each update
+        :param noise_size(int): Number of gaussian values in the shared noise table
+        :param n_process(int): Number of worker processes, 1 plays in this process
+        :param n_episodes(int): Number of games played by each perturbation
+        :param dtype(np.dtype): Precision of the parameters and of the noise table
+        :param seed(int): Seed of the noise table and of the offsets sampling
+        :param env_factory(callable): Builds envs as env_factory(worker_id=..., seed=...), replaces unity_env_name
+        :param fused_inference(bool): Runs networks with the compiled FusedInference engine instead of numpy
+        """
+        self.networks_shape = networks_shape or [21,16,3]
+        if network is None:
+            network = NeuralNetwork(self.networks_shape, contiguous=True, dtype=dtype)
+        else:
+            self.networks_shape = network.shape
+        self.n_params = genome_size(self.networks_shape)
+        self.theta = SharedArray((self.n_params,), dtype)          # current parameters, read by all workers
+        self.theta.array[:] = network.to_genome()
+        self.noise = SharedArray((max(noise_size, self.n_params + 1),), dtype)
+        self.noise.array[:] = np.random.default_rng(seed).standard_normal(len(self.noise.array), dtype=np.float32)
+        self.parameters = None      # copy of the final parameters once the shared blocks are freed, see close
+        self.rng = np.random.default_rng(None if seed is None else seed + 1)
+
+        self.n_pairs = max(1, population_size // 2)
+        self.iteration_number = iteration_number
+        self.sigma = sigma
+        self.learning_rate = learning_rate
+        self.weight_decay = weight_decay
+        self.n_process = n_process
+        self.n_episodes = n_episodes
+        self.dtype = dtype
+        self.unity_env_name = unity_env_name
+        self.env_factory = env_factory or UnityEnvFactory(unity_env_name)
+        self.fused_inference = fused_inference
+
+        self.game = None            # Game of this process when n_process == 1
+        self.pool = None            # EvaluationPool running evolution_strategies_worker, started at first evaluation
+        self.iteration_durations = []
+        self.iteration_performances = []
+        self.bytes_sent = []        # bytes of messages exchanged with workers at each iteration
+
+    def start(self):
+        """
+        Main function operating evolution strategies
+
+        Steps at each iteration:
+        1- Sampling perturbation offsets in the noise table
+        2- Playing parameters + and - each perturbation
+        3- Rank-weighted update of the parameters
+
+        Workers, env and shared blocks are freed at the end (see close), it can only be started once
+        """
+        try:
+            for iteration in range(1, self.iteration_number + 1):
+                start_time = time.time()
+                offsets = self.rng.integers(0, len(self.noise.array) - self.n_params, self.n_pairs)
+                positive, negative, n_bytes = self.evaluation(offsets)
+                self.update(offsets, positive, negative)
+                NeuralNetwork.from_genome(self.networks_shape, self.theta.array).save(name="es_iter_"+str(iteration))
+                self.bytes_sent.append(n_bytes)
+                self.print_iteration(positive, negative, iteration, time.time() - start_time)
+        finally:
+            self.close()
+
+    def evaluation(self, offsets):
+        """
+        Plays the mirrored perturbations designated by :param offsets, in workers if any
+
+        :param offsets:(np.ndarray of int) Offsets of the perturbations in the noise table
+        :return:(tuple) Scores of the + perturbations, scores of the - perturbations, bytes sent to and from workers
+        """
+        if self.n_process == 1:
+            if self.game is None:
+                env = self.env_factory(worker_id=0, seed=0)
+                self.game = Game.session(unity_env=env, time_scale=100.0, width=0, height=0, target_frame_rate=-1,
+                                         quality_level=0, fused_inference=self.fused_inference)
+            positive, negative = rollouts(self.game, self.theta.array, self.noise.array, offsets,
+                                          self.networks_shape, self.sigma, self.n_episodes)
+            return positive, negative, 0
+        if self.pool is None:
+            self.start_workers()
+        n_bytes = 0
+        chunks = np.array_split(np.arange(len(offsets)), min(self.n_process * 4, len(offsets)))
+        for chunk in chunks:
+            task = (chunk[0], offsets[chunk].tolist())      # seeds only, parameters are in shared memory
+            n_bytes += len(pickle.dumps(task))
+            self.pool.tasks.put(task)
+        positive, negative = np.zeros(len(offsets)), np.zeros(len(offsets))
+        for _ in chunks:
+            result = self.pool.next_result()
+            n_bytes += len(pickle.dumps(result))
+            first, chunk_positive, chunk_negative, error = result
+            if error is not None:
+                raise RuntimeError("Evolution strategies worker failed:\n" + error)
+            positive[first:first + len(chunk_positive)] = chunk_positive
+            negative[first:first + len(chunk_negative)] = chunk_negative
+        return positive, negative, n_bytes
+
+    def update(self, offsets, positive, negative):
+        """
+        Moves the parameters along the rank-weighted sum of the perturbations
+
+        :param offsets:(np.ndarray of int) Offsets of the perturbations in the noise table
+        :param positive:(np.ndarray) Scores of parameters + sigma * perturbation
+        :param negative:(np.ndarray) Scores of parameters - sigma * perturbation
+        """
+        ranks = centered_ranks(np.concatenate((positive, negative)))
+        weights = ranks[:len(offsets)] - ranks[len(offsets):]
+        perturbations = self.noise.array[offsets[:, np.newaxis] + np.arange(self.n_params)]    # (n_pairs, n_params)
+        gradient = weights @ perturbations / (len(offsets) * self.sigma)
+        theta = self.theta.array
+        theta += (self.learning_rate * (gradient - self.weight_decay * theta)).astype(self.dtype)
+
+    def start_workers(self):
+        """
+        Starts the worker processes in an EvaluationPool, each one attaches the shared parameters and noise table and
+        opens its env
+        """
+        self.pool = EvaluationPool(self.env_factory, self.n_process, worker=evolution_strategies_worker,
+                                   worker_args=(self.theta.descriptor(), self.noise.descriptor(), self.networks_shape,
+                                                self.sigma, self.n_episodes), fused_inference=self.fused_inference)
+
+    def network(self):
+        """
+        :return:(NeuralNetwork) Copy of the current parameters as a network
+        """
+        parameters = self.parameters if self.theta is None else self.theta.array
+        return NeuralNetwork.from_genome(self.networks_shape, parameters.copy())
+
+    def close(self):
+        """
+        Stops workers, closes the env and frees the shared parameters and noise table (removed from shared memory),
+        only network() can be used afterwards, calling it again does nothing
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+        if self.game is not None:
+            self.game.unity_env.close()
+            self.game = None
+        if self.theta is not None:
+            self.parameters = self.theta.array.copy()
+            self.theta.close()
+            self.noise.close()
+            self.theta = self.noise = None
+
+    def print_iteration(self, positive, negative, iteration, iteration_time):
+        """
+        Shows info about current iteration
+        """
+        scores = np.concatenate((positive, negative))
+        self.iteration_durations.append(iteration_time)
+        self.iteration_performances.append(np.mean(scores))
+        print("\nDuration : ", iteration_time)
+        print("Best Fitness iteration", iteration, " : ", np.max(scores))
+        print("Average all = ", self.iteration_performances[-1])
+        print("Bytes sent = ", self.bytes_sent[-1], " (full genomes would be ",
+              2 * len(positive) * self.n_params * np.dtype(self.dtype).itemsize, ")")
+
+
+def centered_ranks(scores):
+    """
+    :param scores:(np.ndarray) Scores to rank
+    :return:(np.ndarray) Ranks of the scores scaled in [-0.5, 0.5], insensitive to the scale of the scores
+    """
+    ranks = np.empty(len(scores))
+    ranks[np.argsort(scores, kind='stable')] = np.arange(len(scores))
+    return ranks / max(len(scores) - 1, 1) - 0.5
+
+
+def rollouts(game, theta, noise, offsets, shape, sigma, n_episodes=1):
+    """
+    Plays parameters + and - sigma * each perturbation, all perturbations are built from the noise table
+
+    :param game:(Game) Game wrapping the env where games will be played
+    :param theta:(np.ndarray) Current parameters
+    :param noise:(np.ndarray) Noise table
+    :param offsets:(array of int) Offsets of the perturbations in the noise table
+    :param shape:(list of int) Networks shape
+    :param sigma:(float) Standard deviation of the perturbations
+    :param n_episodes:(int) Number of games played by each perturbation
+    :return:(tuple) Mean scores of the + perturbations and of the - perturbations
+    """
+    offsets = np.asarray(offsets)
+    perturbations = noise[offsets[:, np.newaxis] + np.arange(len(theta))] * theta.dtype.type(sigma)
+    genomes = np.concatenate((theta + perturbations, theta - perturbations))
+    scores = np.mean(game.play(PopulationTensor.from_genomes(shape, genomes), n_episodes), axis=0)
+    return scores[:len(offsets)], scores[len(offsets):]
+
+
+def evolution_strategies_worker(tasks, results, env_factory, worker_id, index, fused_inference, theta, noise, shape,
+                                sigma, n_episodes):
+    """
+    Loop of an evolution strategies worker, run by an EvaluationPool: plays the perturbations designated by offsets
+    until it receives None (see worker_loop)
+
+    :param tasks:(multiprocessing.Queue) (index of the first perturbation, offsets) tuples
+    :param results:(multiprocessing.Queue) Where (index, + scores, - scores, None) is put,
+    (index, None, None, traceback) on failure
+    :param env_factory:(callable) Builds the env of this worker
+    :param worker_id:(int) Given to env_factory, it is also the seed of the env
+    :param index:(int) Index of the worker in the pool
+    :param fused_inference:(bool) See worker_loop
+    :param theta:(tuple) SharedArray descriptor of the parameters
+    :param noise:(tuple) SharedArray descriptor of the noise table
+    """
+    theta, noise = SharedArray.attach(theta), SharedArray.attach(noise)
+
+    def handle(game, task):
+        first, offsets = task
+        try:
+            positive, negative = rollouts(game, theta.array, noise.array, offsets, shape, sigma, n_episodes)
+            results.put((first, positive.tolist(), negative.tolist(), None))
+        except Exception:
+            results.put((first, None, None, traceback.format_exc()))
+
+    try:
+        worker_loop(tasks, env_factory, worker_id, handle, fused_inference)
+    finally:
+        theta.close()
+        noise.close()
@@ -13,21 +13,24 @@ A module to implement a game taking place in a UnityEnvironment
 
 import numpy as np
 from mlagents_envs.side_channel.engine_configuration_channel import EngineConfigurationChannel
+from mlagents_envs.timers import hierarchical_timer, timed
 
 from neural_network import *
 
 
-
 class Game:
     """ Game Class
 
     Game is a wrapper that takes a UnityEnvironment and makes a set of NeuralNetworks play in this environment.
-    The game stops when all agents are done and returns their scores. An Agent does not play again when he's done.
+    With start, the game stops when all agents are done and returns their scores, an Agent does not play again when
+    he's done. With play, agents are slots that take the next pending network as soon as they are done.
     A Game might contain multiple simulations to make multiple neural networks play at the same time.
+    Use Game.session to get the long-lived Game of an env instead of building a new one for every evaluation.
 
     """
 
-    def __init__(self, unity_env, time_scale=1.0, width=720, height=480, target_frame_rate=60, quality_level=5):
+    def __init__(self, unity_env, time_scale=1.0, width=720, height=480, target_frame_rate=60, quality_level=5,
+                 fused_inference=False):
         """ Initializes the game
 
         :param unity_env: (UnityEnvironment) Environment where the game will be played
@@ -36,43 +39,185 @@ class Game:
         :param height:(int) Window's height
         :param target_frame_rate:(int) Frame rate
         :param quality_level:(int) Visual quality
+        :param fused_inference:(bool) Runs networks with the compiled FusedInference engine instead of numpy
 
         Todo: Commentate a little, reorganise
         """
         self.unity_env = unity_env
-        self.unity_env.reset()
-        engine_configuration_channel = EngineConfigurationChannel()
-        engine_configuration_channel.set_configuration_parameters(time_scale=time_scale, width=width, height=height,
-                                                                  target_frame_rate=target_frame_rate, quality_level=quality_level)
-        self.unity_env.side_channels[2] = engine_configuration_channel
+        self.resets = 0             # number of env resets, redundant ones are skipped (see reset)
+        self.fresh = False          # True while no step was made since the last reset
+        self.steps = 0              # number of env steps (one step moves all agents)
+        self.reset()
+        self.engine_configuration_channel = EngineConfigurationChannel()
+        self.configuration = None
+        self.configure(time_scale, width, height, target_frame_rate, quality_level)
+        self.unity_env.side_channels[2] = self.engine_configuration_channel
 
         self.group_name = unity_env.get_agent_groups()[0]
         self.group_spec = unity_env.get_agent_group_spec(self.group_name)
         self.n_agents = self.unity_env.get_step_result(self.group_name).n_agents()
         self.action_size = self.group_spec.action_size
+        self.fused_inference = fused_inference
+        self.inference = None       # FusedInference engine, built for the shape of the first population played
+        self.occupancy = 1.0        # fraction of agent steps spent playing a game during the last call to play
+
+    @classmethod
+    def session(cls, unity_env, time_scale=1.0, width=720, height=480, target_frame_rate=60, quality_level=5,
+                fused_inference=None):
+        """
+        Long-lived Game of an env: it is built (and the env reset) at the first call only, later calls send the
+        engine configuration again only if it changed
+        The Game is kept on the env itself, so both are freed together once the env is no longer used
+
+        :param unity_env: (UnityEnvironment) Environment where the games will be played
+        :param fused_inference:(bool) See __init__, None keeps the current setting of the Game (False for a new one)
+        :return:(Game) The Game of this env
+        """
+        game = getattr(unity_env, '_game_session', None)
+        if game is None:
+            game = cls(unity_env, time_scale, width, height, target_frame_rate, quality_level, bool(fused_inference))
+            unity_env._game_session = game
+        else:
+            game.configure(time_scale, width, height, target_frame_rate, quality_level)
+            if fused_inference is not None:
+                game.fused_inference = fused_inference
+        return game
+
+    def configure(self, time_scale=1.0, width=720, height=480, target_frame_rate=60, quality_level=5):
+        """
+        Queues the engine configuration, unless it is the one already sent
+        """
+        configuration = (time_scale, width, height, target_frame_rate, quality_level)
+        if configuration != self.configuration:
+            self.engine_configuration_channel.set_configuration_parameters(
+                time_scale=time_scale, width=width, height=height, target_frame_rate=target_frame_rate,
+                quality_level=quality_level)
+            self.configuration = configuration
+
+    def reset(self, force=False):
+        """
+        Resets the env, unless no step was made since the last reset
+
+        :param force:(bool) Resets anyway
+        """
+        if force or not self.fresh:
+            self.unity_env.reset()
+            self.resets += 1
+            self.fresh = True
 
+    @timed
     def start(self, neural_nets):
         """
         Play the game until all agents are done
 
-        :param neural_nets:(list of NeuralNetwork) Neural nets that will play the game
-        :return:(list of float) Scores for each NeuralNetwork
+        Inference is batched: observations of all agents are stacked and every agent's own network is evaluated
+        in a single matmul per layer (see PopulationTensor.feed_forward)
 
-        Todo: Make code more readable, factorise and commentate
+        :param neural_nets:(list of NeuralNetwork or PopulationTensor) Neural nets that will play the game
+        :return:(list of float) Scores for each NeuralNetwork
         """
-        n_nets = len(neural_nets)
-        self.unity_env.reset()
+        if isinstance(neural_nets, PopulationTensor):
+            population = neural_nets
+        else:
+            population = PopulationTensor.from_networks(neural_nets)
+        n_nets = len(population)
+        self.reset()
         step_result = self.unity_env.get_step_result(self.group_name)
-        done = [False if i < n_nets else True for i in range(self.n_agents)]
-        score = [0 for _ in range(n_nets)]
-        while not all(done):
-            observations = [step_result.obs[0][i].reshape((-1,1)) for i in range(self.n_agents)]
-            actions = np.array([np.array((neural_nets[i].feed_forward(observations[i]).flatten()-0.5)*2) if not done[i] else np.array([0, 0])
-                                for i in range(self.n_agents)])
-            self.unity_env.set_actions(self.group_name, actions)
-            self.unity_env.step()
-            step_result = self.unity_env.get_step_result(self.group_name)
-            mask = step_result.done
-            score = [score[i]+step_result.reward[i] if not done[i] else score[i] for i in range(n_nets)]
-            done = [a or b for a, b in zip(mask, done)]
-        return score
+        done = np.arange(self.n_agents) >= n_nets           # agents without a network are done from the start
+        score = np.zeros(n_nets)
+        actions = np.zeros((self.n_agents, self.action_size), dtype=np.float32)
+        self.prepare_inference(population)
+        while not done.all():
+            with hierarchical_timer("inference"):
+                if self.fused_inference:
+                    outputs = self.inference.population_feed_forward(population.genomes, step_result.obs[0][:n_nets])
+                else:
+                    observations = step_result.obs[0][:n_nets, :, np.newaxis]       # one input column per network
+                    outputs = population.feed_forward(observations)[:, :, 0]
+            actions[:n_nets] = (outputs - 0.5) * 2
+            actions[done] = 0                                                   # done agents stay still
+            with hierarchical_timer("env.step"):
+                self.unity_env.set_actions(self.group_name, actions)
+                self.unity_env.step()
+                step_result = self.unity_env.get_step_result(self.group_name)
+            self.steps += 1
+            self.fresh = False
+            score += np.where(done[:n_nets], 0, step_result.reward[:n_nets])
+            done |= step_result.done
+        return score.tolist()
+
+    @timed
+    def play(self, neural_nets, n_rounds=1):
+        """
+        Makes every neural net play n_rounds games, agents are used as slots: as soon as an agent is done, the next
+        pending game is assigned to it (agents reset by themselves), so agents do not wait for the others to be done
+        and a partial batch of networks does not leave agents idle while there are games left
+        The observation of a freshly reassigned agent is still the terminal one of its previous game, so its first
+        action in the new game is a zero action instead of a decision taken on another episode
+
+        :param neural_nets:(list of NeuralNetwork or PopulationTensor) Neural nets that will play the games
+        :param n_rounds:(int) Number of games played by each network
+        :return:(np.ndarray) Scores of shape (n_rounds, number of networks)
+        """
+        if isinstance(neural_nets, PopulationTensor):
+            population = neural_nets
+        else:
+            population = PopulationTensor.from_networks(neural_nets)
+        n_nets = len(population)
+        n_games = n_nets * n_rounds
+        scores = np.zeros(n_games)                      # game g is network g % n_nets playing round g // n_nets
+        slot_game = np.full(self.n_agents, -1)          # game played by each agent, -1 when idle
+        slot_score = np.zeros(self.n_agents)
+        restarted = np.zeros(self.n_agents, dtype=bool)  # agents given a new game at the last step
+        slot_genomes = np.zeros((self.n_agents, population.genomes.shape[1]), dtype=population.dtype)
+        slots = PopulationTensor.from_genomes(population.shape, slot_genomes)   # network of each agent
+        n_started = min(self.n_agents, n_games)
+        slot_game[:n_started] = np.arange(n_started)
+        slot_genomes[:n_started] = population.genomes[slot_game[:n_started] % n_nets]
+        actions = np.zeros((self.n_agents, self.action_size), dtype=np.float32)
+        self.prepare_inference(population)
+        busy_steps = total_steps = 0
+        self.reset()
+        step_result = self.unity_env.get_step_result(self.group_name)
+        while (slot_game >= 0).any():
+            with hierarchical_timer("inference"):
+                if self.fused_inference:
+                    outputs = self.inference.population_feed_forward(slot_genomes, step_result.obs[0])
+                else:
+                    outputs = slots.feed_forward(step_result.obs[0][:, :, np.newaxis])[:, :, 0]
+            active = slot_game >= 0
+            actions[:] = (outputs - 0.5) * 2
+            actions[~active | restarted] = 0              # idle agents stay still, new games start with no decision
+            restarted[:] = False
+            with hierarchical_timer("env.step"):
+                self.unity_env.set_actions(self.group_name, actions)
+                self.unity_env.step()
+                step_result = self.unity_env.get_step_result(self.group_name)
+            self.steps += 1
+            self.fresh = False
+            slot_score += np.where(active, step_result.reward, 0)
+            busy_steps += active.sum()
+            total_steps += self.n_agents
+            finished = np.flatnonzero(active & step_result.done)
+            if len(finished):
+                scores[slot_game[finished]] = slot_score[finished]
+                slot_score[finished] = 0
+                slot_game[finished] = -1
+                new_games = np.arange(n_started, min(n_started + len(finished), n_games))
+                refilled = finished[:len(new_games)]                            # next games go to freed agents
+                slot_game[refilled] = new_games
+                slot_genomes[refilled] = population.genomes[new_games % n_nets]
+                restarted[refilled] = True
+                n_started += len(new_games)
+        self.occupancy = busy_steps / max(total_steps, 1)
+        return scores.reshape(n_rounds, n_nets)
+
+    def prepare_inference(self, population):
+        """
+        Builds the FusedInference engine if fused inference is used and the population shape or dtype changed
+
+        :param population:(PopulationTensor) Population about to play
+        """
+        if self.fused_inference and (self.inference is None or list(self.inference.shape) != list(population.shape)
+                                     or self.inference.dtype != population.dtype):
+            self.inference = FusedInference(population.shape, capacity=self.n_agents, dtype=population.dtype)
@@ -12,23 +12,32 @@ A module to implement a genetic algorithm to train neural networks in a Unity En
 """
 
 import time
-from random import randint
 from game import*
-from mlagents_envs.environment import UnityEnvironment
+from mlagents_envs.timers import timed
 
+from checkpoint import *
 from crossover import *
 from evaluation import *
 from mutation import *
 from neural_network import *
+from selection import *
+from telemetry import *
 
 
 class GeneticAlgorithm:
     """ Genetic Algorithm Class """
 
     def __init__(self, unity_env_name, networks=None, networks_shape=None, population_size=1000, generation_number = 100,
-                 crossover_rate=0.3, crossover_method='neuron', mutation_rate=0.7, mutation_method='weight', n_process=1):
+                 crossover_rate=0.3, crossover_method='neuron', mutation_rate=0.7, mutation_method='weight', n_process=1,
+                 dtype=np.float64, storage_dtype=None, mutation_gene_rate=0.05, mutation_sigma=0.1, seed=None,
+                 selection_method='tournament', tournament_size=3, reevaluate_stale=False,
+                 fitness_cache_size=100000, fitness_resample_rate=0.1, env_factory=None, n_episodes=4,
+                 fitness_aggregation='mean', fitness_quantile=0.25, env_worker_id=0, save_prefix="gen_",
+                 evaluator=None, checkpoint_path=None, checkpoint_interval=1, telemetry_path=None,
+                 timers_path=None, fused_inference=False):
         """ Initializes the genetic algorithm
 
+        :param unity_env_name(str): Path to built unity game
         :param networks(list of NeuralNetwork): First generation networks
         :param networks_shape(list of int): List defining number of layers and number of neurons in each layer
         :param population_size(int): Number of networks for each generation
@@ -36,7 +45,38 @@ class GeneticAlgorithm:
         :param crossover_rate(int): Proportion of children to be produced at each generation
         :param crossover_method(str): How children will be produced
         :param mutation_rate(int): Proportion of the population to mutate at each generation
-        :param mutation_method(str): How mutation will be done
+        :param mutation_method(str): How mutation will be done ('weight', 'neuron' or 'gaussian')
+        :param dtype(np.dtype): Precision of the population's weights, float32 halves memory and avoids upcasting
+        the float32 observations sent by the env
+        :param storage_dtype(np.dtype): Precision used to archive the best network of each generation (e.g. float16),
+        same as dtype by default
+        :param mutation_gene_rate(float): Probability of each gene to be perturbed by the 'gaussian' mutation method
+        :param mutation_sigma(float): Standard deviation of the 'gaussian' mutation method
+        :param seed(int): Seed of the random generator drawing the first population and driving the genetic operators
+        :param selection_method(str): How parents are selected from known scores ('tournament', 'rank', 'truncation')
+        :param tournament_size(int): Number of contenders in each tournament
+        :param reevaluate_stale(bool): Evaluates individuals whose score is stale (never evaluated or mutated since)
+        before selecting parents, in a single batched evaluation
+        :param fitness_cache_size(int): Number of genomes whose score is remembered so they are not replayed,
+        0 disables the cache
+        :param fitness_resample_rate(float): Probability for a cached genome to be evaluated again anyway
+        :param env_factory(callable): Builds envs as env_factory(worker_id=..., seed=...), replaces unity_env_name
+        to use another BaseEnv (see UnityEnvFactory)
+        :param n_episodes(int): Number of games played by each individual at each evaluation
+        :param fitness_aggregation(str): How the scores of these games make a fitness ('mean', 'min' or 'quantile')
+        :param fitness_quantile(float): Quantile of the games scores used by the 'quantile' aggregation
+        :param env_worker_id(int): worker_id (and seed) of the main env, evaluation workers take the next ones
+        :param save_prefix(str): Prefix of the files where the best network of each generation is saved
+        :param evaluator: Plays the games instead of local processes, anything with the evaluate method of an
+        EvaluationPool (e.g. remote.EvaluationServer)
+        :param checkpoint_path(str): File where the whole state is saved in the background, see checkpoint and resume
+        :param checkpoint_interval(int): Number of generations between checkpoints
+        :param telemetry_path(str): File (.jsonl or .csv) where a record is written for each generation, see
+        generation_record
+        :param timers_path(str): JSON file where the tree of hierarchical timers is saved after each generation and at
+        the end of the run, see telemetry.save_timer_tree
+        :param fused_inference(bool): Runs networks with the compiled FusedInference engine instead of numpy, in this
+        process and in evaluation workers
 
         Todo: Replace n_agent as it will describe the number of simulations
         Todo: use yaml for easier configuration,
@@ -46,11 +86,13 @@ class GeneticAlgorithm:
         if self.networks_shape is None:             # if no shape is provided
             self.networks_shape = [21,16,3]         # default shape
         self.networks = networks
+        self.rng = np.random.default_rng(seed)
 
         if networks is None:                                  # if no networks are provided
-            self.networks = []
-            for i in range(population_size):                  # producing population
-                self.networks.append(NeuralNetwork(self.networks_shape))
+            self.population = PopulationTensor(self.networks_shape, population_size, dtype, self.rng)  # seeded
+            self.networks = self.population.networks()                                         # individuals are views
+        else:
+            self.population = PopulationTensor.from_networks(networks)
 
         self.population_size = population_size
         self.generation_number = generation_number
@@ -58,16 +100,63 @@ class GeneticAlgorithm:
         self.crossover_method = crossover_method
         self.mutation_rate = mutation_rate
         self.mutation_method = mutation_method
+        self.mutation_gene_rate = mutation_gene_rate
+        self.mutation_sigma = mutation_sigma
+        self.selection_method = selection_method
+        self.tournament_size = tournament_size
+        self.reevaluate_stale = reevaluate_stale
         self.n_process = n_process
+        self.dtype = dtype
+        self.storage_dtype = storage_dtype
+        self.n_episodes = n_episodes
+        self.fitness_aggregation = fitness_aggregation
+        self.fitness_quantile = fitness_quantile
+        self.fitness_cache = None
+        if fitness_cache_size > 0:              # scores are only reused for the seeds of the evaluation envs
+            seeds = (env_worker_id,) if n_process == 1 else tuple(range(env_worker_id + 1, env_worker_id + n_process + 1))
+            self.fitness_cache = FitnessCache(fitness_cache_size, fitness_resample_rate, seeds=seeds, rng=self.rng)
 
         self.unity_env_name = unity_env_name
-        self.env = UnityEnvironment(base_port = 5006, file_name=unity_env_name, seed=0, no_graphics=True)
-        self.env.reset()
-        group_name = self.env.get_agent_groups()[0]
-        self.n_agents = self.env.get_step_result(group_name).n_agents()
+        self.env_factory = env_factory or UnityEnvFactory(unity_env_name)
+        self.env_worker_id = env_worker_id
+        self.save_prefix = save_prefix
+        self.fused_inference = fused_inference
+        self.env = self.env_factory(worker_id=env_worker_id, seed=env_worker_id)
+        self.game = Game.session(unity_env=self.env, time_scale=100.0, width=0, height=0, target_frame_rate=-1,
+                                 quality_level=0, fused_inference=fused_inference)     # long-lived, reused
+        self.pool = None        # persistent EvaluationPool, started at the first multi-process evaluation
+        self.closed_pool_resets = 0
+        self.evaluator = evaluator
+        self.n_agents = self.game.n_agents
 
         self.generation_durations = []
         self.generation_performances = []
+        self.generation_throughputs = []        # evaluations per second, to compare generational and steady-state
+        self.evaluation_count = 0               # number of individuals evaluated so far
+        self.reported_evaluations = 0
+        self.generation_resets = []             # env resets made during each generation
+        self.reported_resets = 0
+        self.closed_pool_steps = 0
+        self.reported_steps = 0
+        self.reported_cache = (0, 0, 0)         # fitness cache hits, misses and resamples at the last record
+        self.stage_timer = StageTimer()         # time spent in each stage of the current generation
+        self.telemetry_path = telemetry_path
+        self.telemetry = None                   # background writer of the records, opened with the first one
+        self.timers_path = timers_path
+
+        self.generation = 0             # number of generations completed
+        self.candidates = None          # PopulationTensor scored through ask and tell, see prepare_generation
+        self.keys = None                # their fitness cache keys
+        self.pending = None             # indices of candidates not asked yet
+        self.asked = None               # indices of candidates asked and not told yet
+        self.reevaluated = None         # indices of the stale individuals being re-evaluated, if so
+        self.n_old = 0                  # number of candidates from the previous population
+        self.crossover_number = 0
+        self.generation_start = None
+
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_writer = None   # background thread writing checkpoints, started with the first one
 
     def start(self):
         """
@@ -75,153 +164,516 @@ class GeneticAlgorithm:
 
         Steps at each generation:
         1- Parents selection
-        2- Offsprings production
+        2- Offsprings production (two candidates per child)
         3- Mutated individuals production
-        4- Evaluation of whole population (old population + offsprings + mutated individuals)
+        4- Evaluation of whole population (old population + offsprings candidates + mutated individuals),
+           only the best candidate of each offspring is kept
         5- Additional mutations on random individuals (seems to improve learning)
         6- Keeping only population_size individuals, throwing bad performers
 
+        It only drives evaluation, steps are made by ask and tell (see run_generation)
+        It stops once generation_number generations are completed, so a resumed run only does the remaining ones
+
         Todo: Consider different sequences of steps, make it modular or user built
         """
-        networks = self.networks
-        population_size = self.population_size
-        crossover_number = int(self.crossover_rate*self.population_size)   # calculate number of children to be produced
-        mutation_number = int(self.mutation_rate*self.population_size)     # calculate number of mutation to be done
+        try:
+            while self.generation < self.generation_number:
+                self.run_generation()
+        finally:
+            self.close_pool()           # workers and their envs live for the whole run
+            if self.checkpoint_writer is not None:
+                self.checkpoint_writer.flush()
+            if self.telemetry is not None:
+                self.telemetry.flush()
+            if self.timers_path is not None:
+                save_timer_tree(self.timers_path)
+        self.networks = self.population.networks()
+
+    @timed
+    def run_generation(self):
+        """
+        Runs a single generation: candidates given by ask are played (see play) and their scores given to tell
+
+        :return:(PopulationTensor) Next population, ranked
+        """
+        generation = self.generation
+        while self.generation == generation:
+            genomes = self.ask()
+            players = PopulationTensor.from_genomes(self.population.shape, genomes)
+            if len(players):
+                self.play(players)
+            self.tell(players.scores)
+        return self.population
+
+    def ask(self, n=None):
+        """
+        Gives candidates waiting for a score, so that anything can play them at any batch size
+        When a generation starts, parents are selected and offsprings are made (see start): the old population,
+        offsprings candidates and mutants are the candidates, except those whose score is known by the fitness cache.
+        With reevaluate_stale, stale individuals are asked first, before parents are selected.
+
+        :param n:(int) Maximum number of candidates, all remaining ones by default
+        :return:(np.ndarray) (k, n_params) genomes of the candidates, tell expects their scores in the same order
+        """
+        if self.candidates is None:
+            self.prepare_generation()
+        n = len(self.pending) if n is None else n
+        asked, self.pending = self.pending[:n], self.pending[n:]
+        self.asked = np.concatenate((self.asked, asked))
+        return self.candidates.genomes[asked]
+
+    def tell(self, scores):
+        """
+        Ingests the scores of the oldest candidates asked and not told yet, the generation ends (steps 4 to 6 of
+        start) once all of its candidates are scored
+
+        :param scores:(array of float) Scores of these candidates
+        :return:(bool) True if a generation was completed
+        """
+        scores = np.asarray(scores, dtype=np.float64)
+        if len(scores) > len(self.asked):
+            raise ValueError("Got " + str(len(scores)) + " scores for " + str(len(self.asked)) + " asked candidates")
+        told, self.asked = self.asked[:len(scores)], self.asked[len(scores):]
+        if self.fitness_cache is not None:
+            scores = self.fitness_cache.store([self.keys[i] for i in told], scores)
+        self.candidates.scores[told] = scores
+        self.candidates.stale[told] = False
+        self.evaluation_count += len(told)
+        if len(self.pending) or len(self.asked):
+            return False
+        if self.reevaluated is not None:        # stale individuals are scored, parents can be selected
+            self.population.scores[self.reevaluated] = self.candidates.scores
+            self.population.stale[self.reevaluated] = False
+            self.candidates = None
+            return False
+        self.finish_generation()
+        return True
+
+    def prepare_generation(self):
+        """
+        Makes the candidates of the next call to ask: stale individuals to re-evaluate or a new generation (steps 1 to
+        3 of start), scores known by the fitness cache are filled in
+        """
+        if self.generation_start is None:
+            self.generation_start = time.time()
+        population = self.population
+        stale = np.flatnonzero(population.stale[:self.population_size])
+        if self.reevaluate_stale and len(stale):       # batched re-evaluation of stale individuals only
+            self.reevaluated = stale
+            self.candidates = population.take(stale)
+        else:
+            self.reevaluated = None
+            self.crossover_number = int(self.crossover_rate*self.population_size)  # number of children to produce
+            mutation_number = int(self.mutation_rate*self.population_size)         # number of mutation to be done
+            with self.stage_timer('selection'):
+                parents = self.parent_selection(population, self.crossover_number, self.population_size)
+            with self.stage_timer('crossover'):
+                offsprings = self.children_production(population, self.crossover_number, parents)   # children
+            with self.stage_timer('mutation'):
+                mutants = self.mutation_production(population, mutation_number, self.population_size)  # mutants
+            self.n_old = len(population)
+            self.candidates = PopulationTensor.concatenate([population, offsprings, mutants])   # old and new ones
+        self.pending = np.arange(len(self.candidates))
+        self.asked = np.zeros(0, dtype=int)
+        if self.fitness_cache is not None:
+            with self.stage_timer('evaluation'):
+                self.keys = self.fitness_cache.keys(self.candidates.genomes)
+                scores, missing = self.fitness_cache.lookup(self.keys)
+            self.candidates.scores[:] = scores
+            self.candidates.stale[~missing] = False
+            self.pending = np.flatnonzero(missing)
+
+    def finish_generation(self):
+        """
+        Steps 4 to 6 of start, once all candidates are scored
+        """
+        population, n_old, crossover_number = self.candidates, self.n_old, self.crossover_number
+        self.generation += 1
+        with self.stage_timer('sort'):
+            winners = crossover_winners(population.scores[n_old:n_old + 2*crossover_number], crossover_number)
+            kept = np.concatenate((np.arange(n_old), n_old + winners,                 # best candidate of each child
+                                   np.arange(n_old + 2*crossover_number, len(population))))
+            population = population.take(kept[np.argsort(-population.scores[kept], kind='stable')])  # ranking
+        with self.stage_timer('save'):
+            population[0].save(name=self.save_prefix+str(self.generation), dtype=self.storage_dtype)   # saving best
+
+        with self.stage_timer('mutation'):
+            extra = self.rng.integers(10, len(population), int(0.2*len(population)))    # More random mutations
+            batch_mutate(population, extra, self.mutation_method, self.rng,             # because it helps
+                         self.mutation_gene_rate, self.mutation_sigma)
+
+        self.population = population[:self.population_size]     # Keeping only best individuals
+        self.candidates = None
+        iteration_time = time.time() - self.generation_start
+        self.generation_start = None
+        self.print_generation(self.population, self.generation, iteration_time)
+        if self.timers_path is not None:
+            save_timer_tree(self.timers_path)
+        if self.checkpoint_path is not None and self.generation % self.checkpoint_interval == 0:
+            self.checkpoint()
+
+    def checkpoint(self, path=None):
+        """
+        Saves the population, its scores, the generation counter, the history and the random generator state in a
+        single file, written on a background thread (see checkpoint.CheckpointWriter)
+        Note: the fitness cache is not saved, it is filled again after resuming
+
+        :param path:(str) Checkpoint file, self.checkpoint_path by default
+        """
+        if self.checkpoint_writer is None:
+            self.checkpoint_writer = CheckpointWriter()
+        population = self.population
+        arrays = {'genomes': population.genomes, 'scores': population.scores, 'stale': population.stale,
+                  'durations': np.asarray(self.generation_durations, dtype=np.float64),
+                  'performances': np.asarray(self.generation_performances, dtype=np.float64),
+                  'throughputs': np.asarray(self.generation_throughputs, dtype=np.float64),
+                  'resets': np.asarray(self.generation_resets, dtype=np.int64)}
+        metadata = {'shape': [int(size) for size in population.shape], 'generation': self.generation,
+                    'evaluation_count': self.evaluation_count, 'rng': self.rng.bit_generator.state}
+        self.checkpoint_writer.write(path or self.checkpoint_path, arrays, metadata)
+
+    def resume(self, path=None):
+        """
+        Restores the state saved by checkpoint, start() then runs the remaining generations
+        Arrays are read rather than memory-mapped: no view of the file is kept, so the next checkpoint can replace it
+        (a mapped file cannot be replaced on Windows)
+
+        :param path:(str) Checkpoint file, self.checkpoint_path by default
+        """
+        arrays, metadata = load_checkpoint(path or self.checkpoint_path, mmap=False)
+        self.population = PopulationTensor.from_genomes(metadata['shape'], arrays['genomes'], arrays['scores'],
+                                                        arrays['stale'])
+        self.networks = self.population.networks()
+        self.networks_shape = metadata['shape']
+        self.generation = metadata['generation']
+        self.evaluation_count = self.reported_evaluations = metadata['evaluation_count']
+        self.generation_durations = arrays['durations'].tolist()
+        self.generation_performances = arrays['performances'].tolist()
+        self.generation_throughputs = arrays['throughputs'].tolist()
+        self.generation_resets = arrays['resets'].tolist()
+        self.rng.bit_generator.state = metadata['rng']
+        self.candidates = None
+
+    def emigrants(self, population, k):
+        """
+        Copies of the :param k best individuals, as compact arrays to be sent to other islands
+
+        :param population:(PopulationTensor) Ranked population
+        :return:(tuple) (k, n) genomes and (k,) scores
+        """
+        return population.genomes[:k].copy(), population.scores[:k].copy()
+
+    def immigrate(self, population, genomes, scores):
+        """
+        Replaces the worst individuals with individuals coming from another island
+
+        :param population:(PopulationTensor) Ranked population
+        :param genomes:(np.ndarray) (k, n) genomes of the immigrants
+        :param scores:(np.ndarray) (k,) scores of the immigrants
+        :return:(PopulationTensor) Ranked population
+        """
+        k = min(len(genomes), len(population))
+        population.genomes[len(population) - k:] = genomes[:k]
+        population.scores[len(population) - k:] = scores[:k]
+        population.stale[len(population) - k:] = False
+        return population.take(np.argsort(-population.scores, kind='stable'))
+
+    def start_steady_state(self, evaluation_number=None):
+        """
+        Steady-state asynchronous variant of start, there is no generation barrier
 
-        gen = 0                                         # current generation
-        for _ in range(self.generation_number):
-            start_time = time.time()
-            gen += 1
+        Small batches of new individuals (one env worth of agents) are bred from current scores and evaluated by the
+        workers as soon as one is free. Once a batch is scored, each of its individuals replaces the loser of an
+        inverse tournament if it does at least as well, and a new batch is bred. Progress is shown every
+        population_size evaluations, like a generation.
+        Note: the fitness cache is not used here, new individuals are nearly always unseen ones
 
-            parents = self.parent_selection(networks, crossover_number, population_size)       # parent selection
-            children = self.children_production(crossover_number, parents)                     # children making
-            mutations = self.mutation_production(networks, mutation_number, population_size)   # mutations making
+        :param evaluation_number:(int) Number of individuals to evaluate, generation_number*population_size by default
+        """
+        if evaluation_number is None:
+            evaluation_number = self.generation_number * self.population_size
+        population = self.population
+        if population.stale.any():
+            self.evaluation(population)
+        batch_size = self.n_agents
+        asynchronous = self.n_process > 1 and self.evaluator is None
+        n_pending = 2 * self.n_process if asynchronous else 1      # batches in flight, so workers never wait
+        gen = 0
+        evaluated = 0
+        submitted = 0
+        start_time = time.time()
+        try:
+            if asynchronous:
+                if self.pool is None:
+                    self.pool = EvaluationPool(self.env_factory, self.n_process, self.env_worker_id + 1,
+                                               fused_inference=self.fused_inference)
+                self.pool.open_slots(n_pending, batch_size, population.genomes.shape[1], population.dtype,
+                                     self.n_episodes)
+            pending = {}
+            while evaluated < evaluation_number:
+                while len(pending) < n_pending and submitted < evaluation_number:
+                    offsprings = self.breed(population, min(batch_size, evaluation_number - submitted))
+                    submitted += len(offsprings)
+                    if not asynchronous:
+                        self.play(offsprings)
+                        self.evaluation_count += len(offsprings)
+                        pending[None] = offsprings
+                    else:
+                        pending[self.pool.submit(offsprings)] = offsprings
+                if not asynchronous:
+                    offsprings = pending.pop(None)
+                else:
+                    with self.stage_timer('evaluation'):
+                        ticket, results = self.pool.collect()
+                    offsprings = pending.pop(ticket)
+                    offsprings.scores[:] = aggregate_scores(results, self.fitness_aggregation, self.fitness_quantile)
+                    offsprings.stale[:] = False
+                    self.evaluation_count += len(offsprings)
+                with self.stage_timer('selection'):
+                    self.replacement(population, offsprings)
+                evaluated += len(offsprings)
+
+                if evaluated >= (gen + 1) * self.population_size or evaluated >= evaluation_number:
+                    gen += 1
+                    with self.stage_timer('sort'):
+                        ranking = population.take(np.argsort(-population.scores, kind='stable'))
+                    with self.stage_timer('save'):
+                        ranking[0].save(name=self.save_prefix+str(gen), dtype=self.storage_dtype)     # best so far
+                    end_time = time.time()
+                    self.print_generation(ranking, gen, end_time - start_time)
+                    if self.timers_path is not None:
+                        save_timer_tree(self.timers_path)
+                    start_time = end_time
+        finally:
+            self.close_pool()
+            if self.telemetry is not None:
+                self.telemetry.flush()
+            if self.timers_path is not None:
+                save_timer_tree(self.timers_path)
+        self.population = population
+        self.networks = population.networks()
+
+    def breed(self, population, n):
+        """
+        Produces :param n new individuals from parents selected on current scores, as crossover candidates and
+        mutants in the proportions of crossover_rate and mutation_rate
+
+        :param population:(PopulationTensor) Population the parents come from
+        :param n:(int) Number of new individuals
+        :return:(PopulationTensor) New individuals, not evaluated yet
+        """
+        n_pairs = int(n * self.crossover_rate / (self.crossover_rate + self.mutation_rate)) // 2
+        with self.stage_timer('selection'):
+            parents = selection(population.scores, n, self.selection_method, self.rng, self.tournament_size)
+        with self.stage_timer('mutation'):
+            offsprings = [batch_mutation(population, parents[2*n_pairs:], self.mutation_method, self.rng,
+                                         self.mutation_gene_rate, self.mutation_sigma)]
+        if n_pairs > 0:         # both candidates of each pair compete for a place
+            with self.stage_timer('crossover'):
+                offsprings.append(batch_crossover(population, parents[:n_pairs], parents[n_pairs:2*n_pairs],
+                                                  self.crossover_method, self.rng))
+        return PopulationTensor.concatenate(offsprings)
+
+    def replacement(self, population, offsprings):
+        """
+        Inserts evaluated individuals in place of losers: for each individual, the worst of tournament_size random
+        individuals is replaced if it does not do better
 
-            networks = networks + children + mutations                      # old population and new individuals
-            self.evaluation(networks)                                       # evaluation of neural nets
-            networks.sort(key=lambda Network: Network.score, reverse=True)  # ranking neural nets
-            networks[0].save(name="gen_"+str(gen))                          # saving best of current generation
+        :param population:(PopulationTensor) Population updated in place
+        :param offsprings:(PopulationTensor) Evaluated new individuals
+        """
+        contenders = self.rng.integers(0, len(population), (len(offsprings), self.tournament_size))
+        for child, group in enumerate(contenders):      # sequential, a child may replace a previous one
+            loser = group[np.argmin(population.scores[group])]
+            if offsprings.scores[child] >= population.scores[loser]:
+                population.genomes[loser] = offsprings.genomes[child]
+                population.scores[loser] = offsprings.scores[child]
+                population.stale[loser] = False
+
+    def resets(self):
+        """
+        :return:(int) Number of env resets made so far by this process and the evaluation workers
+        """
+        return self.game.resets + (self.pool.resets if self.pool is not None else 0) + self.closed_pool_resets
 
-            for _ in range(int(0.2*len(networks))):              # More random mutations because it helps
-                rand = randint(10, len(networks)-1)
-                networks[rand] = mutation(networks[rand], self.mutation_method)
+    def steps(self):
+        """
+        :return:(int) Number of env steps made so far by this process, the evaluation workers and the evaluator
+        (if it counts them, like remote.EvaluationServer)
+        """
+        return (self.game.steps + (self.pool.steps if self.pool is not None else 0) + self.closed_pool_steps
+                + getattr(self.evaluator, 'steps', 0))
 
-            networks = networks[:population_size]       # Keeping only best individuals
-            end_time = time.time()
-            iteration_time = end_time-start_time
-            self.print_generation(networks, gen, iteration_time)
+    def close_pool(self):
+        """
+        Shuts the evaluation workers and their envs down, the pool is started again if needed
+        """
+        if self.pool is not None:
+            self.closed_pool_resets += self.pool.resets
+            self.closed_pool_steps += self.pool.steps
+            self.pool.close()
+            self.pool = None
 
-    def parent_selection(self, networks, crossover_number, population_size):
+    def close(self):
+        """
+        Shuts the evaluation workers down and closes the env
         """
-        Parent selection function, takes 3 random individuals and makes a tournament between them,
-        the winner is selected as a parent
+        self.close_pool()
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.flush()
+        if self.telemetry is not None:
+            self.telemetry.close()
+            self.telemetry = None
+        self.env.close()
+
+    @timed
+    def parent_selection(self, population, crossover_number, population_size):
+        """
+        Parent selection function, picks all parents at once from already known scores
+        (with a tournament between 3 random individuals by default, see self.selection_method)
 
-        :param networks:(list of NeuralNetwork) Neural nets to be selected as parents or not
+        :param population:(PopulationTensor) Neural nets to be selected as parents or not
         :param crossover_number:(int) Number of parents needed
         :param population_size:(int) Size of whole neural nets population
-        :return:(list of NeuralNetwork) list of selected parents
-
-        Todo: Use pseudo parallelization to speed up
+        :return:(np.ndarray of int) Indices of the selected parents
         """
-        parents = []
-        for i in range(crossover_number):
-            parent = self.tournament(networks[randint(0, population_size - 1)],
-                                     networks[randint(0, population_size - 1)],
-                                     networks[randint(0, population_size - 1)])
-            parents.append(parent)
-        return parents
+        return selection(population.scores[:population_size], crossover_number, self.selection_method, self.rng,
+                         self.tournament_size)
 
-    def children_production(self, crossover_number, parents):
+    @timed
+    def children_production(self, population, crossover_number, parents):
         """
         Takes randomly 2 parents in the parents list and makes them crossover to give a child
+        All pairs are produced at once with batch_crossover, each child comes as two candidates which are evaluated
+        with the rest of the generation (see crossover_winners)
         Note: the crossover method is contained in self.crossover_method
 
+        :param population:(PopulationTensor) Population the parents come from
         :param crossover_number:(int) Number of children needed
-        :param parents:(list of NeuralNetwork) Potential parents
-        :return:(list of NeuralNetwork) Children
-
-        Todo: Use pseudo parallelization to speed up
+        :param parents:(np.ndarray of int) Potential parents
+        :return:(PopulationTensor) 2*crossover_number candidates, children i candidates are i and crossover_number+i
         """
-        children = []
-        for i in range(crossover_number):
-            child = crossover(self.env, parents[randint(0, crossover_number - 1)],
-                              parents[randint(0, crossover_number - 1)], self.crossover_method)
-            children.append(child)
-        return children
+        pairs = parents[self.rng.integers(0, len(parents), (2, crossover_number))]      # random pairs of parents
+        return batch_crossover(population, pairs[0], pairs[1], self.crossover_method, self.rng)
 
-    def mutation_production(self, networks, mutation_number, population_size):
+    @timed
+    def mutation_production(self, population, mutation_number, population_size):
         """
         Makes new individuals from individuals in the current population by mutating them
+        All mutants are produced at once with batch_mutation
         Note: it does not affect current individuals but actually creates new ones
 
-        :param networks:(list of NeuralNetwork) Neural nets to randomly become mutants
+        :param population:(PopulationTensor) Neural nets to randomly become mutants
         :param mutation_number:(int) number of mutants needed
         :param population_size:(int) Size of whole neural nets population
-        :return:(list of NeuralNetwork) New individuals (mutants)
-
-        Todo: Use pseudo parallelization to speed up
+        :return:(PopulationTensor) New individuals (mutants)
         """
-        mutants = []
-        for i in range(mutation_number):
-            mut = mutation(networks[randint(0, population_size - 1)], self.mutation_method)      # mutant making
-            mutants.append(mut)                                               # append mutant
-        return mutants
+        parents = self.rng.integers(0, population_size, mutation_number)      # random parents
+        return batch_mutation(population, parents, self.mutation_method, self.rng,
+                              self.mutation_gene_rate, self.mutation_sigma)
 
-    def evaluation(self, networks):
+    @timed
+    def evaluation(self, population):
         """
-        Takes the population of neural nets and makes them play 4 games each, a NeuralNetwork.score is the mean
-        of its 4 games
+        Evaluates the population, only individuals unknown to the fitness cache (or re-sampled) play their games
 
-        :param networks:(list of NeuralNetwork)
+        :param population:(PopulationTensor) Its scores are updated
+        """
+        if self.fitness_cache is None:
+            self.play(population)
+            self.evaluation_count += len(population)
+            return
+        keys = self.fitness_cache.keys(population.genomes)
+        scores, missing = self.fitness_cache.lookup(keys)
+        if missing.any():
+            missing = np.flatnonzero(missing)
+            players = population.take(missing)
+            self.play(players)
+            self.evaluation_count += len(players)
+            scores[missing] = self.fitness_cache.store([keys[i] for i in missing], players.scores)
+        population.scores[:] = scores
+        population.stale[:] = False
+
+    def play(self, population):
         """
+        Takes the population of neural nets and makes them play self.n_episodes games each, the score of an individual
+        aggregates its games (mean by default, see self.fitness_aggregation)
 
-        if self.n_process == 1:
-            results = single_process_evaluation(self.env, networks, self.n_agents)
-            for i in range(len(networks)):
-                networks[i].score = np.mean([results[0][i], results[1][i], results[2][i], results[3][i]])
-        else:
-            results = multi_process_evaluation(networks, self.unity_env_name, self.n_process, self.n_agents)
-            for i in range(len(networks)):
-                networks[i].score = results[i]
-
-    def tournament(self, net1, net2, net3):
-        """
-        Takes 3 neural nets, makes them play a game each and select the best performer
-
-        :param net1:(NeuralNetwork) 1st participant
-        :param net2:(NeuralNetwork) 2nd participant
-        :param net3:(NeuralNetwork) Last but not least, the third contender
-        :return:(NeuralNetwork) The winning neural net
-
-        Todo: Use pseudo parallelization to speed up
-        Todo: Write better return conditions
-        """
-        game = Game(unity_env=self.env, time_scale=100.0, width=0, height=0, target_frame_rate=-1, quality_level=0)
-        score1 = game.start([net1])                # net1 plays a game and so on..
-        score2 = game.start([net2])
-        score3 = game.start([net3])
-        maxscore = max(score1, score2, score3)     # the best one is returned
-        if maxscore == score1:
-            return net1
-        elif maxscore == score2:
-            return net2
-        else:
-            return net3
+        :param population:(PopulationTensor) Its scores are updated
+        """
 
-    def print_generation(self, networks, gen, iteration_time):
+        with self.stage_timer('evaluation'):
+            if self.evaluator is not None:
+                results = self.evaluator.evaluate(population, self.n_episodes, batch_size=self.n_agents)
+            elif self.n_process == 1:
+                results = single_process_evaluation(self.env, population, self.n_episodes)
+            else:
+                if self.pool is None:
+                    self.pool = EvaluationPool(self.env_factory, self.n_process, self.env_worker_id + 1,
+                                               fused_inference=self.fused_inference)
+                results = self.pool.evaluate(population, self.n_episodes, batch_size=self.n_agents)
+        population.scores[:] = aggregate_scores(results, self.fitness_aggregation, self.fitness_quantile)
+        population.stale[:] = False
+
+    def generation_record(self, population, gen, iteration_time):
         """
-        Shows info about current generation
+        Sums up a generation and adds it to the history (durations, performances, throughputs and resets)
+        Counts and stage times are the ones since the previous record
 
-        Todo: Replace with more complete performance analysis, plots etc. Store results in a file maybe
+        :param population:(PopulationTensor) Ranked population
+        :param gen:(int) Generation number
+        :param iteration_time:(float) Duration of the generation in seconds
+        :return:(dict) Flat record, stage times are in seconds
         """
+        scores = population.scores
+        evaluations = self.evaluation_count - self.reported_evaluations
+        self.reported_evaluations = self.evaluation_count
         self.generation_durations.append(iteration_time)
-        self.generation_performances.append(np.mean([networks[i].score for i in range(len(networks))]))
-        top_mean = np.mean([networks[i].score for i in range(6)])
-        bottom_mean = np.mean([networks[-i].score for i in range(1, 6)])
-        print("Pop size = ", len(networks))
-        print("\nDuration : ", iteration_time)
-        print("Best Fitness gen", gen, " : ", networks[0].score)
-        print("Average all = ", self.generation_performances[-1])
-        print("Average top 6 = ", top_mean)
-        print("Average last 6 = ", bottom_mean)
+        self.generation_performances.append(np.mean(scores))
+        self.generation_throughputs.append(evaluations / iteration_time)
+        resets, steps = self.resets(), self.steps()
+        self.generation_resets.append(resets - self.reported_resets)
+        record = {'generation': gen, 'time': time.time(), 'duration': iteration_time,
+                  'population_size': len(population), 'best': float(scores[0]),
+                  'mean': float(self.generation_performances[-1]), 'top_mean': float(np.mean(scores[:6])),
+                  'bottom_mean': float(np.mean(scores[-5:])), 'evaluations': evaluations,
+                  'evaluations_per_second': self.generation_throughputs[-1],
+                  'episodes': evaluations * self.n_episodes, 'env_steps': steps - self.reported_steps,
+                  'env_resets': self.generation_resets[-1]}
+        self.reported_resets, self.reported_steps = resets, steps
+        durations = self.stage_timer.reset()
+        for stage in ('selection', 'crossover', 'mutation', 'evaluation', 'sort', 'save'):
+            record[stage + '_time'] = durations.get(stage, 0.0)
+        cache = (0, 0, 0)
+        if self.fitness_cache is not None:
+            cache = (self.fitness_cache.hits, self.fitness_cache.misses, self.fitness_cache.resamples)
+        record['cache_hits'], record['cache_misses'], record['cache_resamples'] = (
+            int(now - before) for now, before in zip(cache, self.reported_cache))
+        self.reported_cache = cache
+        record['worker_utilization'] = float(np.mean(self.pool.utilization)) if self.pool is not None else None
+        return record
+
+    def print_generation(self, population, gen, iteration_time):
+        """
+        Shows info about current generation, and writes its record (see generation_record) if telemetry_path is set
 
+        Todo: Replace with more complete performance analysis, plots etc.
+        """
+        record = self.generation_record(population, gen, iteration_time)
+        if self.telemetry_path is not None:
+            if self.telemetry is None:      # a resumed run adds its records to the previous ones
+                self.telemetry = TelemetryWriter(self.telemetry_path, append=gen > 1)
+            self.telemetry.write(record)
+        print("Pop size = ", record['population_size'])
+        print("\nDuration : ", iteration_time)
+        print("Best Fitness gen", gen, " : ", record['best'])
+        print("Average all = ", record['mean'])
+        print("Average top 6 = ", record['top_mean'])
+        print("Average last 6 = ", record['bottom_mean'])
+        print("Evaluations/s = ", record['evaluations_per_second'])
+        print("Env resets = ", record['env_resets'], " steps = ", record['env_steps'])
+        if self.fitness_cache is not None:
+            print("Fitness cache hits = ", self.fitness_cache.hits, " misses = ", self.fitness_cache.misses,
+                  " resamples = ", self.fitness_cache.resamples)
+        if self.pool is not None:
+            print("Workers utilization = ", np.round(self.pool.utilization, 2))
@@ -0,0 +1,176 @@
+# Valentin Macé
+# valentin.mace@kedgebs.com
+# Developed for fun
+# Feel free to use this code as you wish as long as you quote me as author
+
+"""
+island.py
+~~~~~~~~~~
+
+A module to implement an island model: several genetic algorithms evolve their own population in separate processes,
+each one with its own env, and periodically exchange their best individuals
+
+"""
+
+import multiprocessing as mp
+import os
+import queue
+import traceback
+import numpy as np
+
+from genetic_algorithm import *
+
+
+class IslandModel:
+    """ Island Model Class
+
+    Every island is a GeneticAlgorithm running in its own process. Every migration_interval generations, each island
+    sends copies of its migration_size best genomes (with their scores) to its neighbours and replaces its worst
+    individuals with the immigrants it received. Migration does not wait: an island takes whatever has arrived.
+
+    """
+
+    def __init__(self, n_islands=4, topology='ring', migration_interval=5, migration_size=5, seed=None,
+                 **ga_parameters):
+        """ Initializes the island model
+
+        :param n_islands:(int) Number of islands, i.e. of processes
+        :param topology:(str) Where emigrants go, 'ring' (next island) or 'full' (all other islands)
+        :param migration_interval:(int) Number of generations between migrations
+        :param migration_size:(int) Number of individuals sent by an island at each migration
+        :param seed:(int) Island i uses seed + i
+        :param ga_parameters: Parameters of each GeneticAlgorithm (unity_env_name, population_size, n_process...)
+        save_prefix, telemetry_path, timers_path and checkpoint_path get an "island<i>_" prefix so that islands write
+        separate files, island i uses env_worker_id + i * (n_process + 1) so that their envs never share a worker_id
+        """
+        if topology not in ('ring', 'full'):
+            raise ValueError("Unknown topology: " + str(topology))
+        self.n_islands = n_islands
+        self.topology = topology
+        self.migration_interval = migration_interval
+        self.migration_size = migration_size
+        self.seed = seed
+        self.ga_parameters = ga_parameters
+        self.population = None      # merged and ranked populations of all islands, once started
+
+    def neighbours(self, i):
+        """
+        :param i:(int) Index of an island
+        :return:(list of int) Islands receiving the emigrants of island i
+        """
+        if self.n_islands == 1:
+            return []
+        if self.topology == 'ring':
+            return [(i + 1) % self.n_islands]
+        return [j for j in range(self.n_islands) if j != i]
+
+    def start(self):
+        """
+        Runs all islands until their last generation
+
+        :return:(PopulationTensor) Individuals of all islands, ranked
+        """
+        inboxes = [mp.Queue() for _ in range(self.n_islands)]
+        results = mp.Queue()
+        n_process = self.ga_parameters.get('n_process', 1)
+        islands = []
+        for i in range(self.n_islands):
+            parameters = dict(self.ga_parameters, seed=None if self.seed is None else self.seed + i,
+                              env_worker_id=self.ga_parameters.get('env_worker_id', 0) + i * (n_process + 1))
+            parameters.setdefault('save_prefix', "gen_")
+            for path in ('save_prefix', 'telemetry_path', 'timers_path', 'checkpoint_path'):    # a file per island
+                if parameters.get(path):
+                    directory, name = os.path.split(parameters[path])
+                    parameters[path] = os.path.join(directory, "island" + str(i) + "_" + name)
+            islands.append(mp.Process(target=island_job,
+                                      args=(i, parameters, inboxes[i], [inboxes[j] for j in self.neighbours(i)],
+                                            results, self.migration_interval, self.migration_size)))
+        for island in islands: island.start()
+        sub_results = self.collect(islands, results)
+        for inbox in inboxes:                   # last emigrants nobody took, so that senders can exit
+            drain(inbox)
+        for island in islands: island.join()
+
+        sub_results.sort(key=lambda tup: tup[0])
+        errors = [sub_result[1] for sub_result in sub_results if isinstance(sub_result[1], str)]
+        if errors:
+            raise RuntimeError("Island failed:\n" + errors[0])
+        population = PopulationTensor.concatenate([PopulationTensor.from_genomes(*sub_result[1])
+                                                   for sub_result in sub_results])
+        self.population = population.take(np.argsort(-population.scores, kind='stable'))
+        return self.population
+
+
+    def collect(self, islands, results, poll_interval=1.0):
+        """
+        Waits for the result of every island, an island whose process died without posting one (e.g. killed) gets an
+        error instead of blocking forever
+
+        :param islands:(list of multiprocessing.Process) Island processes
+        :param results:(multiprocessing.Queue) Where islands put their result, see island_job
+        :param poll_interval:(float) Seconds between checks of the island processes
+        :return:(list) (i, result or traceback) of each island
+        """
+        sub_results = []
+        while len(sub_results) < len(islands):
+            try:
+                sub_results.append(results.get(timeout=poll_interval))
+                continue
+            except queue.Empty:
+                pass
+            done = {sub_result[0] for sub_result in sub_results}
+            dead = [i for i, island in enumerate(islands) if i not in done and island.exitcode is not None]
+            if dead:
+                sub_results += drain(results)       # results posted just before exiting
+                done = {sub_result[0] for sub_result in sub_results}
+                sub_results += [(i, "Island " + str(i) + " died, exit code " + str(islands[i].exitcode))
+                                for i in dead if i not in done]
+        return sub_results
+
+
+def drain(inbox):
+    """
+    :param inbox:(multiprocessing.Queue) Queue to empty without waiting
+    :return:(list) Messages that were in the queue
+    """
+    messages = []
+    while True:
+        try:
+            messages.append(inbox.get_nowait())
+        except queue.Empty:
+            return messages
+
+
+def island_job(i, parameters, inbox, neighbours, results, migration_interval, migration_size):
+    """
+    Single island evolving its population
+
+    :param i:(int) Index of the island
+    :param parameters:(dict) Parameters of its GeneticAlgorithm
+    :param inbox:(multiprocessing.Queue) Where immigrants arrive, as (genomes, scores) arrays
+    :param neighbours:(list of multiprocessing.Queue) Inboxes of the islands receiving its emigrants
+    :param results:(multiprocessing.Queue) Where (i, (shape, genomes, scores)) of the final population is put,
+    (i, traceback) on failure
+    :param migration_interval:(int) Number of generations between migrations
+    :param migration_size:(int) Number of individuals sent at each migration
+    """
+    try:
+        ga = GeneticAlgorithm(**parameters)
+    except Exception:
+        results.put((i, traceback.format_exc()))
+        return
+    try:
+        for gen in range(1, ga.generation_number + 1):
+            population = ga.run_generation()
+            if gen % migration_interval == 0 and gen < ga.generation_number:
+                emigrants = ga.emigrants(population, migration_size)
+                for neighbour in neighbours:
+                    neighbour.put(emigrants)
+                for genomes, scores in drain(inbox):
+                    population = ga.immigrate(population, genomes, scores)
+                ga.population = population
+        results.put((i, (population.shape, population.genomes, population.scores)))    # arrays, not views
+    except Exception:
+        results.put((i, traceback.format_exc()))
+    finally:
+        ga.close()
@@ -0,0 +1,181 @@
+"""
+Pure NumPy stand-in for the 3DBall environment.
+Every agent balances a ball on a platform it tilts around two axes. It uses the
+same observations (8 floats), actions (2 continuous floats), rewards (0.1 per
+step, -1 when the ball falls) and done semantics as the Unity build. Done
+agents are reset at the next step, like Unity agents. All agents are simulated
+at once with vectorized operations, so the env is fast, headless and
+deterministic for a given seed, which makes it usable for benchmarks and tests
+without a Unity player.
+"""
+
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from mlagents_envs.base_env import (
+    ActionType,
+    AgentGroup,
+    AgentGroupSpec,
+    AgentId,
+    BaseEnv,
+    BatchedStepResult,
+)
+from mlagents_envs.exception import UnityActionException, UnityEnvironmentException
+from mlagents_envs.side_channel.side_channel import SideChannel
+
+
+class BallEnv(BaseEnv):
+    GROUP_NAME = "3DBall"
+    OBSERVATION_SIZE = 8
+    ACTION_SIZE = 2
+    MAX_ANGLE = 28.955  # degrees, the Unity agent stops at a quaternion component of 0.25
+    ANGLE_STEP = 2.0  # degrees of rotation for an action of 1, at every fixed update
+    PLATFORM_HALF_SIZE = 3.0
+    BALL_START_HEIGHT = 4.0
+    BALL_RADIUS = 0.5
+    GRAVITY = 9.81
+    ROLLING = 5.0 / 7.0  # a rolling solid sphere accelerates slower than a sliding one
+    PHYSICS_STEPS = 5  # fixed updates between two decisions
+    PHYSICS_DT = 0.02
+
+    def __init__(
+        self,
+        n_agents: int = 12,
+        seed: int = 0,
+        max_steps: int = 5000,
+        worker_id: int = 0,
+        side_channels: Optional[List[SideChannel]] = None,
+    ):
+        """
+        Creates the agents, takes the same seed and worker_id arguments as a
+        UnityEnvironment so the class can be used as an env factory.
+        :int n_agents: Number of agents, i.e. of platforms.
+        :int seed: Seed of the random generator that places balls and platforms.
+        :int max_steps: Steps after which an agent is done (with max_step set).
+        :int worker_id: Unused, kept for signature compatibility.
+        :list side_channels: Side channels, accepted but never used.
+        """
+        self.n_agents = n_agents
+        self.max_steps = max_steps
+        self.worker_id = worker_id
+        self.side_channels: Dict[int, SideChannel] = {}
+        for channel in side_channels or []:
+            self.side_channels[channel.channel_type] = channel
+        self._spec = AgentGroupSpec(
+            [(self.OBSERVATION_SIZE,)], ActionType.CONTINUOUS, self.ACTION_SIZE
+        )
+        self._rng = np.random.RandomState(seed)
+        self._agent_id = np.arange(n_agents)
+        self._angles = np.zeros((n_agents, 2))  # rotation around z and x, degrees
+        self._position = np.zeros((n_agents, 3))  # ball relative to the platform
+        self._velocity = np.zeros((n_agents, 3))
+        self._steps = np.zeros(n_agents, dtype=np.int64)
+        self._actions = np.zeros((n_agents, self.ACTION_SIZE), dtype=np.float32)
+        self._reward = np.zeros(n_agents, dtype=np.float32)
+        self._done = np.zeros(n_agents, dtype=bool)
+        self._max_step = np.zeros(n_agents, dtype=bool)
+        self.closed = False
+        self.reset()
+
+    def _reset_agents(self, agents: np.ndarray) -> None:
+        n = len(agents)
+        self._angles[agents] = self._rng.uniform(-10.0, 10.0, (n, 2))
+        self._position[agents, 0] = self._rng.uniform(-1.5, 1.5, n)
+        self._position[agents, 1] = self.BALL_START_HEIGHT
+        self._position[agents, 2] = self._rng.uniform(-1.5, 1.5, n)
+        self._velocity[agents] = 0.0
+        self._steps[agents] = 0
+
+    def reset(self) -> None:
+        self._reset_agents(self._agent_id)
+        self._actions[:] = 0.0
+        self._reward[:] = 0.0
+        self._done[:] = False
+        self._max_step[:] = False
+
+    def step(self) -> None:
+        if self.closed:
+            raise UnityEnvironmentException("The environment is closed.")
+        finished = np.flatnonzero(self._done)
+        if len(finished):  # done agents start a new episode
+            self._reset_agents(finished)
+        fell = np.zeros(self.n_agents, dtype=bool)
+        acceleration = np.zeros((self.n_agents, 3))
+        for _ in range(self.PHYSICS_STEPS):  # actions are repeated between decisions
+            self._angles += self.ANGLE_STEP * self._actions
+            np.clip(self._angles, -self.MAX_ANGLE, self.MAX_ANGLE, out=self._angles)
+            radians = np.radians(self._angles)
+            on_platform = self._position[:, 1] <= self.BALL_RADIUS
+            rolling = self.ROLLING * self.GRAVITY * on_platform
+            acceleration[:, 0] = -rolling * np.sin(radians[:, 0])
+            acceleration[:, 1] = np.where(on_platform, 0.0, -self.GRAVITY)
+            acceleration[:, 2] = rolling * np.sin(radians[:, 1])
+            self._velocity += self.PHYSICS_DT * acceleration
+            self._position += self.PHYSICS_DT * self._velocity
+            landed = self._position[:, 1] < self.BALL_RADIUS
+            self._position[landed, 1] = self.BALL_RADIUS
+            self._velocity[landed, 1] = 0.0
+            fell |= (np.abs(self._position[:, 0]) > self.PLATFORM_HALF_SIZE) | (
+                np.abs(self._position[:, 2]) > self.PLATFORM_HALF_SIZE
+            )
+        self._steps += 1
+        self._max_step[:] = ~fell & (self._steps >= self.max_steps)
+        self._done[:] = fell | self._max_step
+        self._reward[:] = np.where(fell, -1.0, 0.1)
+
+    def close(self) -> None:
+        self.closed = True
+
+    def get_agent_groups(self) -> List[AgentGroup]:
+        return [self.GROUP_NAME]
+
+    def _assert_group_exists(self, agent_group: AgentGroup) -> None:
+        if agent_group != self.GROUP_NAME:
+            raise UnityActionException(
+                "The group {0} does not correspond to an existing agent group "
+                "in the environment".format(agent_group)
+            )
+
+    def set_actions(self, agent_group: AgentGroup, action: np.ndarray) -> None:
+        self._assert_group_exists(agent_group)
+        expected_shape = (self.n_agents, self.ACTION_SIZE)
+        if action.shape != expected_shape:
+            raise UnityActionException(
+                "The group {0} needs an input of dimension {1} but received input of dimension {2}".format(
+                    agent_group, expected_shape, action.shape
+                )
+            )
+        np.clip(action, -1.0, 1.0, out=self._actions)
+
+    def set_action_for_agent(
+        self, agent_group: AgentGroup, agent_id: AgentId, action: np.ndarray
+    ) -> None:
+        self._assert_group_exists(agent_group)
+        if not 0 <= agent_id < self.n_agents:
+            raise IndexError(
+                "agent_id {} did not exist in the environment".format(agent_id)
+            )
+        action = np.asarray(action, dtype=np.float32).reshape(self.ACTION_SIZE)
+        self._actions[agent_id] = np.clip(action, -1.0, 1.0)
+
+    def get_step_result(self, agent_group: AgentGroup) -> BatchedStepResult:
+        self._assert_group_exists(agent_group)
+        radians = np.radians(self._angles)
+        obs = np.empty((self.n_agents, self.OBSERVATION_SIZE), dtype=np.float32)
+        obs[:, 0] = np.sin(radians[:, 0] / 2)  # quaternion z, as in the Unity agent
+        obs[:, 1] = np.sin(radians[:, 1] / 2)  # quaternion x
+        obs[:, 2:5] = self._position
+        obs[:, 5:8] = self._velocity
+        return BatchedStepResult(
+            [obs],
+            self._reward.copy(),
+            self._done.copy(),
+            self._max_step.copy(),
+            self._agent_id.copy(),
+            None,
+        )
+
+    def get_agent_group_spec(self, agent_group: AgentGroup) -> AgentGroupSpec:
+        self._assert_group_exists(agent_group)
+        return self._spec
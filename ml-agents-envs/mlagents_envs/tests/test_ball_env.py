@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from mlagents_envs.ball_env import BallEnv
+from mlagents_envs.base_env import ActionType, BatchedStepResult
+from mlagents_envs.exception import UnityActionException, UnityEnvironmentException
+
+
+def run(env, actions, n_steps):
+    results = []
+    for _ in range(n_steps):
+        env.set_actions("3DBall", actions)
+        env.step()
+        results.append(env.get_step_result("3DBall"))
+    return results
+
+
+def test_spec_and_step_result():
+    env = BallEnv(n_agents=5)
+    assert env.get_agent_groups() == ["3DBall"]
+    spec = env.get_agent_group_spec("3DBall")
+    assert spec.action_type == ActionType.CONTINUOUS
+    assert spec.action_size == 2
+    assert spec.observation_shapes == [(8,)]
+    result = env.get_step_result("3DBall")
+    assert isinstance(result, BatchedStepResult)
+    assert result.n_agents() == 5
+    assert result.obs[0].shape == (5, 8)
+    assert result.obs[0].dtype == np.float32
+    assert not result.done.any()
+
+
+def test_deterministic_for_a_seed():
+    actions = np.full((4, 2), 0.3, dtype=np.float32)
+    first = run(BallEnv(n_agents=4, seed=3), actions, 30)
+    second = run(BallEnv(n_agents=4, seed=3), actions, 30)
+    other = run(BallEnv(n_agents=4, seed=4), actions, 30)
+    for a, b in zip(first, second):
+        assert np.array_equal(a.obs[0], b.obs[0])
+        assert np.array_equal(a.reward, b.reward)
+    assert not np.array_equal(first[-1].obs[0], other[-1].obs[0])
+
+
+def test_ball_falls_when_platform_is_tilted():
+    env = BallEnv(n_agents=3)
+    results = run(env, np.ones((3, 2), dtype=np.float32), 100)
+    done = np.array([result.done for result in results])
+    assert done.any(axis=0).all()
+    first_done = done.argmax(axis=0)
+    for agent, step in enumerate(first_done):
+        assert results[step].reward[agent] == pytest.approx(-1.0)
+        assert not results[step].max_step[agent]
+        assert results[step - 1].reward[agent] == pytest.approx(0.1)
+
+
+def test_done_agents_are_reset():
+    env = BallEnv(n_agents=2, max_steps=10)
+    results = run(env, np.zeros((2, 2), dtype=np.float32), 11)
+    assert results[9].done.all() and results[9].max_step.all()
+    assert not results[10].done.any()
+    assert (results[10].obs[0][:, 3] > BallEnv.BALL_START_HEIGHT - 0.5).all()  # ball dropped again
+
+
+def test_set_actions():
+    env = BallEnv(n_agents=2)
+    with pytest.raises(UnityActionException):
+        env.set_actions("3DBall", np.zeros((3, 2), dtype=np.float32))
+    with pytest.raises(UnityActionException):
+        env.get_step_result("OtherGroup")
+    env.set_action_for_agent("3DBall", 1, np.array([5.0, -5.0]))
+    env.step()
+    angles = env.get_step_result("3DBall").obs[0][:, :2]
+    env.close()
+    with pytest.raises(UnityEnvironmentException):
+        env.step()
+    assert angles.shape == (2, 2)
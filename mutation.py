@@ -68,4 +68,117 @@ def bias_mutation(net):
     """
     layer = randint(0, len(net.biases) - 1)  # random layer
     bias = randint(0, len(net.biases[layer]) - 1)  # random bias
-    net.weights[layer][bias] = np.random.randn()  # mutation
\ No newline at end of file
+    net.weights[layer][bias] = np.random.randn()  # mutation
+
+
+def batch_mutation(population, parents, mutation_method, rng=None, gene_rate=0.05, sigma=0.1):
+    """
+    Batch version of mutation: clones all parents at once and mutates every clone with a few numpy operations
+
+    :param population:(PopulationTensor) Population the parents come from
+    :param parents:(array of int) Indices of the parents, one mutant is produced per index (duplicates allowed)
+    :param mutation_method:(str) Where to apply mutation ('weight', 'neuron' or 'gaussian')
+    :param rng:(np.random.Generator) Random generator to use
+    :param gene_rate:(float) Probability of each gene to be perturbed, 'gaussian' method only
+    :param sigma:(float) Standard deviation of the perturbation, 'gaussian' method only
+    :return:(PopulationTensor) Mutants, mutants[i] is a mutated clone of population[parents[i]]
+    """
+    mutants = population.take(parents)      # making copies otherwise we manipulate the actual parents
+    batch_mutate(mutants, np.arange(len(mutants)), mutation_method, rng, gene_rate, sigma)
+    return mutants
+
+
+def batch_mutate(population, indices, mutation_method, rng=None, gene_rate=0.05, sigma=0.1):
+    """
+    Mutates some individuals of a population in place, as mutation does: each individual gets either a bias mutation
+    or a :param mutation_method mutation (the gaussian method perturbs weights and biases alike)
+
+    :param population:(PopulationTensor) Population to modify
+    :param indices:(array of int) Individuals to mutate
+    :param mutation_method:(str) Where to apply mutation ('weight', 'neuron' or 'gaussian')
+    :param rng:(np.random.Generator) Random generator to use
+    :param gene_rate:(float) Probability of each gene to be perturbed, 'gaussian' method only
+    :param sigma:(float) Standard deviation of the perturbation, 'gaussian' method only
+    """
+    rng = rng or np.random.default_rng()
+    indices = np.asarray(indices, dtype=np.intp)
+    population.stale[indices] = True                # their scores are not up to date anymore
+    if mutation_method == 'gaussian':
+        batch_gaussian_mutation(population, indices, gene_rate, sigma, rng)
+        return
+    on_biases = rng.integers(0, 2, len(indices)).astype(bool)      # weights or biases, for each individual
+    if mutation_method == 'weight':
+        batch_weight_mutation(population, indices[~on_biases], rng)
+    elif mutation_method == 'neuron':
+        batch_neuron_mutation(population, indices[~on_biases], rng)
+    batch_bias_mutation(population, indices[on_biases], rng)
+
+
+def batch_weight_mutation(population, indices, rng=None):
+    """
+    Applies mutation to a random weight of each individual
+
+    :param population:(PopulationTensor) Population to modify in place
+    :param indices:(array of int) Individuals to mutate
+    :param rng:(np.random.Generator) Random generator to use
+    """
+    rng = rng or np.random.default_rng()
+    layers = rng.integers(0, population.depth, len(indices))     # random layer for each individual
+    for layer in range(population.depth):
+        selected = indices[layers == layer]
+        weights = population.weights[layer]
+        neurons = rng.integers(0, weights.shape[1], len(selected))     # random neuron
+        inputs = rng.integers(0, weights.shape[2], len(selected))      # random weight
+        weights[selected, neurons, inputs] = rng.standard_normal(len(selected))     # mutation
+
+
+def batch_neuron_mutation(population, indices, rng=None):
+    """
+    Applies mutation to a random neuron of each individual
+
+    :param population:(PopulationTensor) Population to modify in place
+    :param indices:(array of int) Individuals to mutate
+    :param rng:(np.random.Generator) Random generator to use
+    """
+    rng = rng or np.random.default_rng()
+    layers = rng.integers(0, population.depth, len(indices))     # same logic here
+    for layer in range(population.depth):
+        selected = indices[layers == layer]
+        weights = population.weights[layer]
+        neurons = rng.integers(0, weights.shape[1], len(selected))
+        weights[selected, neurons] = rng.standard_normal((len(selected), weights.shape[2]))
+
+
+def batch_bias_mutation(population, indices, rng=None):
+    """
+    Applies mutation to a random bias of each individual
+
+    :param population:(PopulationTensor) Population to modify in place
+    :param indices:(array of int) Individuals to mutate
+    :param rng:(np.random.Generator) Random generator to use
+    """
+    rng = rng or np.random.default_rng()
+    layers = rng.integers(0, population.depth, len(indices))     # random layer for each individual
+    for layer in range(population.depth):
+        selected = indices[layers == layer]
+        biases = population.biases[layer]
+        neurons = rng.integers(0, biases.shape[1], len(selected))      # random bias
+        biases[selected, neurons, 0] = rng.standard_normal(len(selected))     # mutation
+
+
+def batch_gaussian_mutation(population, indices, gene_rate=0.05, sigma=0.1, rng=None):
+    """
+    Adds gaussian noise to the genes of each individual, every gene being perturbed with probability :param gene_rate
+    Note: an individual appearing several times in :param indices is only perturbed once
+
+    :param population:(PopulationTensor) Population to modify in place
+    :param indices:(array of int) Individuals to mutate
+    :param gene_rate:(float) Probability of each gene to be perturbed
+    :param sigma:(float) Standard deviation of the perturbation
+    :param rng:(np.random.Generator) Random generator to use
+    """
+    rng = rng or np.random.default_rng()
+    shape = (len(indices), population.genomes.shape[1])
+    noise = rng.standard_normal(shape, dtype=np.float32) * sigma
+    noise *= rng.random(shape, dtype=np.float32) < gene_rate
+    population.genomes[indices] += noise.astype(population.dtype, copy=False)
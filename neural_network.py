@@ -7,36 +7,108 @@
 neural_network.py
 ~~~~~~~~~~
 
-This module is for building a classic dense neural network
+This module is for building a classic dense neural network, and a population of them stored in stacked arrays
 
 """
 
-from numba import jit
+import copy
+from numba import jit, prange
 import numpy as np
 
 
 class NeuralNetwork:
     """ Neural Network class """
 
-    def __init__(self, shape=None):
+    def __init__(self, shape=None, contiguous=False, dtype=np.float64):
         """ Initializes the neural network
 
         Weights and biases are initialized randomly according to a normal distribution
         A network can be saved and loaded for later use
 
         :param shape:(list of int) Describes how many layers and neurons by layer the network has
+        :param contiguous:(bool) Stores all weights and biases in one flat buffer (self.genome), weights[i] and
+        biases[i] are then reshaped views into it, so cloning, hashing or shipping a network is a single buffer operation
+        :param dtype:(np.dtype) Precision of weights and biases, float32 matches the observations sent by the env
         """
         self.shape = shape
+        self.dtype = np.dtype(dtype)
         self.biases = []
         self.weights = []
+        self.genome = None    # flat buffer backing weights and biases, only in contiguous mode
         self.score = 0        # to remember how well it performed
         if shape:
-            for y in shape[1:]:                             # biases random initialization
-                self.biases.append(np.random.randn(y, 1))
-            for x, y in zip(shape[:-1], shape[1:]):         # weights random initialization
-                self.weights.append(np.random.randn(y, x))
+            if contiguous:
+                self.genome = np.random.randn(genome_size(shape)).astype(dtype)     # random initialization at once
+                self.weights, self.biases = genome_views(self.genome, shape)
+            else:
+                for y in shape[1:]:                             # biases random initialization
+                    self.biases.append(np.random.randn(y, 1).astype(dtype))
+                for x, y in zip(shape[:-1], shape[1:]):         # weights random initialization
+                    self.weights.append(np.random.randn(y, x).astype(dtype))
         self.depth = len(self.biases)
 
+    @classmethod
+    def from_genome(cls, shape, genome, score=0):
+        """
+        Builds a contiguous network around an existing flat genome (no copy is made)
+
+        :param shape:(list of int) Network's shape
+        :param genome:(np.ndarray) Flat buffer of genome_size(shape) parameters
+        :param score:(float) Network's score
+        :return:(NeuralNetwork) Network whose weights and biases are views into genome
+        """
+        net = cls()
+        net.shape = shape
+        net.dtype = genome.dtype
+        net.genome = genome
+        net.weights, net.biases = genome_views(genome, shape)
+        net.depth = len(net.biases)
+        net.score = score
+        return net
+
+    def to_genome(self):
+        """
+        :return:(np.ndarray) Flat genome of the network, the backing buffer itself in contiguous mode
+        """
+        if self.genome is not None:
+            return self.genome
+        return np.concatenate([np.concatenate((np.ravel(w), np.ravel(b))) for w, b in zip(self.weights, self.biases)])
+
+    def clone(self):
+        """
+        Copies the network, a single buffer copy in contiguous mode
+
+        :return:(NeuralNetwork) Independent copy of the network
+        """
+        if self.genome is not None:
+            return NeuralNetwork.from_genome(self.shape, self.genome.copy(), self.score)
+        return copy.deepcopy(self)
+
+    def astype(self, dtype):
+        """
+        Copies the network with another precision, e.g. float16 to archive it or float32 to compute with it
+
+        :param dtype:(np.dtype) Precision of the copy
+        :return:(NeuralNetwork) Converted copy of the network
+        """
+        if self.genome is not None:
+            return NeuralNetwork.from_genome(self.shape, self.genome.astype(dtype), self.score)
+        net = NeuralNetwork()
+        net.shape = self.shape
+        net.dtype = np.dtype(dtype)
+        net.weights = [w.astype(dtype) for w in self.weights]
+        net.biases = [b.astype(dtype) for b in self.biases]
+        net.depth = self.depth
+        net.score = self.score
+        return net
+
+    def __deepcopy__(self, memo):
+        if self.genome is not None:
+            return self.clone()
+        net = NeuralNetwork()
+        net.__dict__.update(copy.deepcopy(self.__dict__, memo))
+        return net
+
     def feed_forward(self, a):
         """
         Main function, takes an input vector and calculate the output by propagation through the network
@@ -50,35 +122,329 @@ class NeuralNetwork:
             a = sigmoid(np.dot(weights[i], a) + biases[i])
         return a
 
-    def save(self, name=None):
+    def save(self, name=None, dtype=None):
         """
         Saves network weights and biases into 2 separated files in current folder
 
         :param name: str, in case you want to name it
+        :param dtype: np.dtype, storage precision (e.g. float16 for archives), network's own precision by default
         :return: creates two files
         """
+        net = self if dtype is None else self.astype(dtype)
         if not name:
-            np.save('saved_weights_'+str(self.score), self.weights)
-            np.save('saved_biases_'+str(self.score), self.biases)
+            np.save('saved_weights_'+str(self.score), net.weights)
+            np.save('saved_biases_'+str(self.score), net.biases)
         else:
-            np.save(name + '_weights', self.weights)
-            np.save(name + '_biases', self.biases)
+            np.save(name + '_weights', net.weights)
+            np.save(name + '_biases', net.biases)
 
     def load(self, filename_weights, filename_biases):
         """
         Loads saved network weights and biases from 2 files into the actual network object
+        Weights are converted to the network's precision, so archives stored in float16 can be loaded for computing
 
         :param filename_weights: file containing saved weights
         :param filename_biases: file containing saved biases
         """
-        self.weights = np.load(filename_weights)
-        self.biases = np.load(filename_biases)
+        weights = np.load(filename_weights, allow_pickle=True)
+        biases = np.load(filename_biases, allow_pickle=True)
+        if self.genome is None:
+            self.weights = [w.astype(self.dtype) for w in weights]
+            self.biases = [b.astype(self.dtype) for b in biases]
+        else:                                   # copying into the views keeps the genome up to date
+            for i in range(self.depth):
+                self.weights[i][...] = weights[i]
+                self.biases[i][...] = biases[i]
+
+
+class PopulationTensor:
+    """ Population Tensor class
+
+    Stores a whole population of NeuralNetwork sharing the same shape in stacked arrays:
+    layer l of every individual lives in a single (P, out, in) array and its biases in a (P, out, 1) array.
+    These arrays are views into one (P, n) genomes matrix whose row i is the flat genome of individual i.
+    An individual is only an index into these arrays, NeuralNetwork views can be built on demand.
+    Operators (selection, mutation, crossover, evaluation) can work on the whole population in bulk.
+
+    """
+
+    def __init__(self, shape=None, size=0, dtype=np.float64, rng=None):
+        """ Initializes the population
+
+        Weights and biases of every individual are initialized randomly according to a normal distribution
+
+        :param shape:(list of int) Describes how many layers and neurons by layer every network has
+        :param size:(int) Number of individuals in the population
+        :param dtype:(np.dtype) Precision of weights and biases
+        :param rng:(np.random.Generator) Random generator drawing the weights, np.random's global state by default
+        """
+        self.shape = shape
+        self.size = size
+        if not shape:
+            self.genomes = np.zeros((size, 0), dtype)
+        elif rng is None:
+            self.genomes = np.random.randn(size, genome_size(shape)).astype(dtype)
+        else:
+            self.genomes = rng.standard_normal((size, genome_size(shape))).astype(dtype)
+        self.weights, self.biases = genome_views(self.genomes, shape) if shape else ([], [])
+        self.scores = np.zeros(size)        # to remember how well each individual performed
+        self.stale = np.ones(size, dtype=bool)      # True when an individual changed since its score was computed
+        self.depth = len(self.biases)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        """
+        :param index:(int or slice) Individual's index, or range of individuals
+        :return:(NeuralNetwork or PopulationTensor) View on the individual, or on the range of individuals
+        """
+        if isinstance(index, slice):
+            return PopulationTensor.from_genomes(self.shape, self.genomes[index], self.scores[index], self.stale[index])
+        return self.network(index)
+
+    @property
+    def dtype(self):
+        return self.genomes.dtype
+
+    @classmethod
+    def from_genomes(cls, shape, genomes, scores=None, stale=None):
+        """
+        Builds a population around an already stacked genomes matrix (no copy is made)
+
+        :param shape:(list of int) Shape of every network
+        :param genomes:(np.ndarray) (P, n) matrix, one flat genome per row
+        :param scores:(np.ndarray) Optional (P,) scores
+        :param stale:(np.ndarray) Optional (P,) booleans, True for individuals whose score is not up to date
+        :return:(PopulationTensor) The population
+        """
+        population = cls()
+        population.shape = shape
+        population.size = len(genomes)
+        population.genomes = genomes
+        population.weights, population.biases = genome_views(genomes, shape)
+        population.scores = np.zeros(population.size) if scores is None else np.asarray(scores, dtype=float)
+        population.stale = np.ones(population.size, dtype=bool) if stale is None else np.asarray(stale, dtype=bool)
+        population.depth = len(population.biases)
+        return population
+
+    @classmethod
+    def from_networks(cls, networks):
+        """
+        Stacks a list of NeuralNetwork into a population (weights are copied)
+
+        :param networks:(list of NeuralNetwork) Networks sharing the same shape
+        :return:(PopulationTensor) The population
+        """
+        genomes = np.stack([net.to_genome() for net in networks])
+        scores = [net.score for net in networks]
+        return cls.from_genomes(networks[0].shape, genomes, scores)
+
+    @classmethod
+    def concatenate(cls, populations):
+        """
+        Joins several populations into a new one
+
+        :param populations:(list of PopulationTensor) Populations sharing the same shape
+        :return:(PopulationTensor) The joined population
+        """
+        genomes = np.concatenate([pop.genomes for pop in populations])
+        scores = np.concatenate([pop.scores for pop in populations])
+        stale = np.concatenate([pop.stale for pop in populations])
+        return cls.from_genomes(populations[0].shape, genomes, scores, stale)
+
+    def take(self, indices):
+        """
+        Builds a new population from some individuals of this one (genomes are copied)
+
+        :param indices:(array of int) Individuals to take, can contain duplicates
+        :return:(PopulationTensor) The new population
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        return PopulationTensor.from_genomes(self.shape, self.genomes[indices], self.scores[indices],
+                                             self.stale[indices])
+
+    def astype(self, dtype):
+        """
+        Copies the population with another precision, e.g. float16 to archive it or float32 to compute with it
+
+        :param dtype:(np.dtype) Precision of the copy
+        :return:(PopulationTensor) Converted copy of the population
+        """
+        return PopulationTensor.from_genomes(self.shape, self.genomes.astype(dtype), self.scores.copy(),
+                                             self.stale.copy())
+
+    def network(self, index):
+        """
+        Builds a NeuralNetwork whose genome is a view on the individual's row
+
+        :param index:(int) Individual's index
+        :return:(NeuralNetwork) Lightweight view on the individual, modifying it modifies the population
+        """
+        return NeuralNetwork.from_genome(self.shape, self.genomes[index], self.scores[index])
+
+    def networks(self):
+        """
+        :return:(list of NeuralNetwork) Views on every individual of the population
+        """
+        return [self.network(i) for i in range(self.size)]
+
+    def feed_forward(self, a):
+        """
+        Feeds each individual its own input in a single batched pass per layer
+
+        :param a:(np.ndarray) (P, in, 1) inputs, row i is given to individual i
+        :return:(np.ndarray) (P, out, 1) output neurons activation
+        """
+        weights = self.weights
+        biases = self.biases
+        for i in range(self.depth):
+            a = array_sigmoid(np.matmul(weights[i], a) + biases[i])
+        return a
+
+
+def genome_size(shape):
+    """
+    :param shape:(list of int) Network's shape
+    :return:(int) Number of parameters (weights and biases) of a network with this shape
+    """
+    return sum(x * y + y for x, y in zip(shape[:-1], shape[1:]))
+
+
+def genome_views(genome, shape):
+    """
+    Cuts a flat genome into weights and biases views
+    Layout is layer by layer, each layer's weights (row major) followed by its biases
+
+    :param genome:(np.ndarray) (n,) flat genome, or (P, n) stacked genomes
+    :param shape:(list of int) Network's shape
+    :return:(list of np.ndarray, list of np.ndarray) Weights (..., out, in) and biases (..., out, 1) views
+    """
+    lead = genome.shape[:-1]
+    weights = []
+    biases = []
+    offset = 0
+    for x, y in zip(shape[:-1], shape[1:]):
+        weights.append(genome[..., offset:offset + y * x].reshape(lead + (y, x)))
+        offset += y * x
+        biases.append(genome[..., offset:offset + y].reshape(lead + (y, 1)))
+        offset += y
+    return weights, biases
 
 
-@jit(nopython=True)
 def sigmoid(z):
     """
     The sigmoid function, classic neural net activation function
-    @jit is used to speed up computation
+    Arrays go through the compiled array_sigmoid, scalars are computed by numpy, both keep the precision of z
+    """
+    if np.ndim(z) == 0:
+        one = z.dtype.type(1) if isinstance(z, np.generic) else 1.0
+        return one / (one + np.exp(-z))
+    return array_sigmoid(np.asarray(z))
+
+
+@jit(nopython=True)
+def array_sigmoid(z):
+    """
+    Sigmoid of an array, @jit is used to speed up computation, computing in place keeps the precision of z (no float64
+    literal)
+    """
+    e = np.exp(-z)
+    e += 1
+    np.reciprocal(e, e)
+    return e
+
+
+class FusedInference:
+    """ Fused Inference class
+
+    Optional compiled inference engine working directly on flat genomes (see genome_views for the layout)
+    All layers run in a single nopython kernel writing into preallocated scratch buffers,
+    the population variant evaluates many individuals in parallel with prange
+
+    """
+
+    def __init__(self, shape, capacity=1, dtype=np.float64):
+        """ Initializes the engine
+
+        :param shape:(list of int) Shape of the networks to run
+        :param capacity:(int) Number of individuals buffers are preallocated for, grown when needed
+        :param dtype:(np.dtype) Dtype of the scratch and output buffers
+        """
+        self.shape = np.asarray(shape, dtype=np.int64)
+        self.dtype = dtype
+        self.scratch = np.empty((capacity, 2, max(shape)), dtype=dtype)
+        self.out = np.empty((capacity, shape[-1]), dtype=dtype)
+
+    def reserve(self, capacity):
+        """
+        Makes sure buffers can hold :param capacity individuals
+        """
+        if len(self.out) < capacity:
+            self.scratch = np.empty((capacity, 2, self.scratch.shape[2]), dtype=self.dtype)
+            self.out = np.empty((capacity, self.out.shape[1]), dtype=self.dtype)
+
+    def feed_forward(self, genome, a):
+        """
+        :param genome:(np.ndarray) (n,) flat genome of a single network
+        :param a:(np.ndarray) (in,) input vector
+        :return:(np.ndarray) (out,) output neurons activation, a view on the engine's buffer
+        """
+        fused_feed_forward(genome, self.shape, a, self.out[0], self.scratch[0])
+        return self.out[0]
+
+    def population_feed_forward(self, genomes, inputs):
+        """
+        :param genomes:(np.ndarray) (P, n) stacked genomes
+        :param inputs:(np.ndarray) (P, in) inputs, row i is given to individual i
+        :return:(np.ndarray) (P, out) output neurons activation, a view on the engine's buffer
+        """
+        n = len(genomes)
+        self.reserve(n)
+        fused_population_feed_forward(genomes, self.shape, inputs, self.out[:n], self.scratch[:n])
+        return self.out[:n]
+
+
+@jit(nopython=True)
+def fused_feed_forward(genome, shape, a, out, scratch):
+    """
+    Whole feed forward pass of a network stored as a flat genome, without any temporary allocation
+
+    :param genome:(np.ndarray) (n,) flat genome
+    :param shape:(np.ndarray of int64) Network's shape
+    :param a:(np.ndarray) (in,) input vector
+    :param out:(np.ndarray) (out,) where output neurons activation is written
+    :param scratch:(np.ndarray) (2, max(shape)) buffer holding the activations of two consecutive layers
+    """
+    for k in range(shape[0]):
+        scratch[0, k] = a[k]
+    current = 0
+    offset = 0
+    for layer in range(len(shape) - 1):
+        x = shape[layer]
+        y = shape[layer + 1]
+        for j in range(y):
+            z = genome[offset + y * x + j]              # bias
+            row = offset + j * x
+            for k in range(x):
+                z += genome[row + k] * scratch[current, k]
+            scratch[1 - current, j] = 1.0 / (1.0 + np.exp(-z))
+        offset += y * x + y
+        current = 1 - current
+    for j in range(shape[-1]):
+        out[j] = scratch[current, j]
+
+
+@jit(nopython=True, parallel=True)
+def fused_population_feed_forward(genomes, shape, inputs, out, scratch):
+    """
+    Runs fused_feed_forward for every individual of a population in parallel
+
+    :param genomes:(np.ndarray) (P, n) stacked genomes
+    :param shape:(np.ndarray of int64) Networks' shape
+    :param inputs:(np.ndarray) (P, in) inputs
+    :param out:(np.ndarray) (P, out) where outputs are written
+    :param scratch:(np.ndarray) (P, 2, max(shape)) one scratch buffer per individual
     """
-    return 1.0 / (1.0 + np.exp(-z))
+    for i in prange(genomes.shape[0]):
+        fused_feed_forward(genomes[i], shape, inputs[i], out[i], scratch[i])
@@ -0,0 +1,306 @@
+# Valentin Macé
+# valentin.mace@kedgebs.com
+# Developed for fun
+# Feel free to use this code as you wish as long as you quote me as author
+
+"""
+remote.py
+~~~~~~~~~~
+
+A module to evaluate neural networks on other machines: an EvaluationServer sends batches of genomes over TCP to
+EvaluationWorkers, each one playing them in its own env and sending their scores back
+
+Every message is a frame: header length (4 bytes) and payload length (8 bytes), a small JSON header, then the
+payload as raw bytes (genomes or scores arrays, never pickled)
+
+Start a worker from the command line with:
+    python remote.py --host <server address> --port 5100 --env <path to built unity game> --worker-id 1
+
+"""
+
+import argparse
+import json
+import queue
+import socket
+import struct
+import threading
+import traceback
+import numpy as np
+
+from evaluation import *
+
+FRAME = struct.Struct('!IQ')
+
+
+def send_message(sock, header, payload=b''):
+    """
+    Sends a frame
+
+    :param sock:(socket.socket) Connected socket
+    :param header:(dict) JSON serializable header, 'type' tells what the message is
+    :param payload:(bytes or np.ndarray) Raw data following the header
+    """
+    header = json.dumps(header).encode()
+    payload = memoryview(np.ascontiguousarray(payload)).cast('B') if isinstance(payload, np.ndarray) else payload
+    sock.sendall(FRAME.pack(len(header), len(payload)) + header)
+    if len(payload):
+        sock.sendall(payload)
+
+
+def receive_exactly(sock, size):
+    """
+    :return:(bytearray) :param size bytes read from :param sock
+    """
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            raise ConnectionError("Connection closed")
+        received += n
+    return data
+
+
+def receive_message(sock):
+    """
+    Waits for a frame
+
+    :param sock:(socket.socket) Connected socket
+    :return:(tuple) Header (dict) and payload (bytearray)
+    """
+    header_size, payload_size = FRAME.unpack(receive_exactly(sock, FRAME.size))
+    header = json.loads(receive_exactly(sock, header_size).decode())
+    return header, receive_exactly(sock, payload_size)
+
+
+class EvaluationServer:
+    """ Evaluation Server class
+
+    Accepts any number of EvaluationWorkers, which register when they connect and may come and go during a run.
+    Batches are handed out to whichever worker is free. A worker that disconnects or stays silent for
+    heartbeat_timeout seconds while playing a batch is dropped and its batch is put back in the queue for another
+    worker. A batch that fails on a worker is not played again: its traceback is raised by evaluate.
+    It has the evaluate method of an EvaluationPool, so a GeneticAlgorithm can use it as its evaluator.
+
+    """
+
+    def __init__(self, host='0.0.0.0', port=5100, heartbeat_timeout=10.0):
+        """ Starts listening for workers
+
+        :param host:(str) Interface to listen on
+        :param port:(int) Port to listen on, 0 picks a free port (see self.address)
+        :param heartbeat_timeout:(float) Seconds without news from a busy worker before its batch is re-queued
+        """
+        self.heartbeat_timeout = heartbeat_timeout
+        self.socket = socket.create_server((host, port))
+        self.address = self.socket.getsockname()
+        self.batches = queue.Queue()        # (batch id, header, payload) waiting for a worker
+        self.results = queue.Queue()        # (batch id, scores, None), (batch id, None, traceback) on failure
+        self.workers = {}                   # name of each registered worker -> number of batches it played
+        self.requeued = 0                   # number of batches lost by a worker and given to another one
+        self.steps = 0                      # env steps reported by the workers
+        self.next_batch = 0
+        self.lock = threading.Lock()
+        self.running = True
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        """
+        Loop accepting worker connections, each one is served by its own thread
+        """
+        while self.running:
+            try:
+                connection, _ = self.socket.accept()
+            except OSError:         # server closed
+                return
+            threading.Thread(target=self.serve, args=(connection,), daemon=True).start()
+
+    def serve(self, connection):
+        """
+        Loop feeding a worker with batches until the server is closed or the worker is lost
+
+        :param connection:(socket.socket) Connection to the worker
+        """
+        connection.settimeout(self.heartbeat_timeout)
+        name = None
+        batch = None
+        try:
+            header, _ = receive_message(connection)
+            if header.get('type') != 'register':
+                return
+            name = header['name']
+            with self.lock:
+                self.workers[name] = 0
+            while self.running:
+                try:
+                    batch = self.batches.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                batch_id, batch_header, payload = batch
+                send_message(connection, batch_header, payload)
+                while True:         # heartbeats until the scores arrive, a timeout means the worker is lost
+                    header, payload = receive_message(connection)
+                    if header.get('type') in ('result', 'error') and header['batch'] == batch_id:
+                        break
+                batch = None
+                if header['type'] == 'error':
+                    self.results.put((batch_id, None, header['traceback']))
+                    continue
+                scores = np.frombuffer(payload, dtype=np.float64).reshape(batch_header['n'], -1)
+                self.results.put((batch_id, scores, None))
+                with self.lock:
+                    self.workers[name] += 1
+                    self.steps += header.get('steps', 0)
+            send_message(connection, {'type': 'stop'})
+        except (OSError, ConnectionError, ValueError, KeyError):
+            pass
+        finally:
+            if batch is not None:
+                self.batches.put(batch)
+                with self.lock:
+                    self.requeued += 1
+            if name is not None:
+                with self.lock:
+                    self.workers.pop(name, None)
+            connection.close()
+
+    def evaluate(self, population, n_episodes=4, batch_size=None):
+        """
+        Cuts the population in batches played by the workers, and waits for all scores
+
+        :param population:(PopulationTensor) Neural nets to be evaluated
+        :param n_episodes:(int) Number of games played by each network
+        :param batch_size:(int) Number of networks per batch, typically the number of agents in an env
+        :return:(np.ndarray) Scores of shape (number of networks, n_episodes), see aggregate_scores
+        """
+        n = len(population)
+        batch_size = batch_size or n
+        scores = np.zeros((n, n_episodes))
+        starts = {}
+        for start in range(0, n, batch_size):
+            genomes = population.genomes[start:start + batch_size]
+            header = {'type': 'batch', 'batch': self.next_batch, 'n': len(genomes), 'n_episodes': n_episodes,
+                      'shape': [int(size) for size in population.shape], 'dtype': genomes.dtype.str}
+            self.batches.put((self.next_batch, header, np.ascontiguousarray(genomes)))
+            starts[self.next_batch] = start
+            self.next_batch += 1
+        errors = []
+        while starts:                       # all results are collected, even after a failure
+            batch_id, batch_scores, error = self.results.get()
+            if batch_id in starts:          # a result of a previous evaluation might arrive late, it is ignored
+                start = starts.pop(batch_id)
+                if error is not None:
+                    errors.append(error)
+                else:
+                    scores[start:start + len(batch_scores)] = batch_scores
+        if errors:
+            raise RuntimeError("Evaluation worker failed:\n" + errors[0])
+        return scores
+
+    def close(self):
+        """
+        Stops serving, connected workers are told to stop
+        """
+        self.running = False
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class EvaluationWorker:
+    """ Evaluation Worker class
+
+    Connects to an EvaluationServer, then plays the batches it receives in its own env until the server stops it.
+    Heartbeats are sent from a separate thread, so the server knows the worker is alive during long batches.
+
+    """
+
+    def __init__(self, env_factory, host='127.0.0.1', port=5100, worker_id=1, heartbeat_interval=2.0, name=None,
+                 fused_inference=False):
+        """ Initializes the worker and its env
+
+        :param env_factory:(callable) Builds the env, called as env_factory(worker_id=..., seed=...)
+        :param host:(str) Address of the server
+        :param port:(int) Port of the server
+        :param worker_id:(int) Given to env_factory, it is also the seed of the env
+        :param heartbeat_interval:(float) Seconds between heartbeats, must be well below the server's timeout
+        :param name:(str) Name given to the server, host name and worker_id by default
+        :param fused_inference:(bool) Runs networks with the compiled FusedInference engine instead of numpy
+        """
+        self.address = (host, port)
+        self.heartbeat_interval = heartbeat_interval
+        self.name = name or socket.gethostname() + ":" + str(worker_id)
+        self.env = env_factory(worker_id=worker_id, seed=worker_id)
+        self.game = Game.session(unity_env=self.env, time_scale=100.0, width=0, height=0, target_frame_rate=-1,
+                                 quality_level=0, fused_inference=fused_inference)
+        self.send_lock = threading.Lock()
+        self.batches_played = 0
+
+    def send(self, sock, header, payload=b''):
+        with self.send_lock:        # heartbeats and results are sent from different threads
+            send_message(sock, header, payload)
+
+    def heartbeat(self, sock, stopped):
+        """
+        Loop sending heartbeats until :param stopped is set or the connection is lost
+        """
+        while not stopped.wait(self.heartbeat_interval):
+            try:
+                self.send(sock, {'type': 'heartbeat'})
+            except OSError:
+                return
+
+    def run(self):
+        """
+        Plays batches until the server sends stop or closes the connection, a batch that fails is reported with its
+        traceback
+        """
+        stopped = threading.Event()
+        with socket.create_connection(self.address) as sock:
+            self.send(sock, {'type': 'register', 'name': self.name})
+            threading.Thread(target=self.heartbeat, args=(sock, stopped), daemon=True).start()
+            try:
+                while True:
+                    header, payload = receive_message(sock)
+                    if header['type'] == 'stop':
+                        break
+                    steps = self.game.steps
+                    try:
+                        genomes = np.frombuffer(payload, dtype=np.dtype(header['dtype'])).reshape(header['n'], -1)
+                        population = PopulationTensor.from_genomes(header['shape'], genomes)
+                        scores = np.transpose(self.game.play(population, header['n_episodes']))
+                    except Exception:
+                        self.send(sock, {'type': 'error', 'batch': header['batch'],
+                                         'traceback': traceback.format_exc()})
+                        continue
+                    self.send(sock, {'type': 'result', 'batch': header['batch'], 'steps': self.game.steps - steps},
+                              scores.astype(np.float64))
+                    self.batches_played += 1
+            except ConnectionError:         # server gone
+                pass
+            finally:
+                stopped.set()
+
+    def close(self):
+        self.env.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Evaluation worker playing the batches of an EvaluationServer")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5100)
+    parser.add_argument('--env', required=True, help="Path to built unity game")
+    parser.add_argument('--worker-id', type=int, default=1, help="Unity worker_id, one per worker on a machine")
+    parser.add_argument('--fused-inference', action='store_true', help="Use the compiled FusedInference engine")
+    args = parser.parse_args()
+    worker = EvaluationWorker(UnityEnvFactory(args.env), args.host, args.port, args.worker_id,
+                              fused_inference=args.fused_inference)
+    try:
+        worker.run()
+    finally:
+        worker.close()
@@ -0,0 +1,82 @@
+# Valentin Macé
+# valentin.mace@kedgebs.com
+# Developed for fun
+# Feel free to use this code as you wish as long as you quote me as author
+
+"""
+selection.py
+~~~~~~~~~~
+
+A module to implement all parent selection routines used in a genetic algorithm
+Selection relies on already known scores, no game is played, and all parents are picked with a single call
+to the random generator
+
+"""
+
+import numpy as np
+
+
+def selection(scores, n_parents, selection_method, rng=None, tournament_size=3, truncation_rate=0.5):
+    """
+    Selects parents according to :param selection_method
+
+    :param scores:(np.ndarray) (P,) scores of the individuals
+    :param n_parents:(int) Number of parents needed
+    :param selection_method:(str) 'tournament', 'rank' or 'truncation'
+    :param rng:(np.random.Generator) Random generator to use
+    :param tournament_size:(int) Number of contenders in each tournament
+    :param truncation_rate:(float) Proportion of best individuals parents are picked from in truncation selection
+    :return:(np.ndarray) (n_parents,) indices of the selected parents
+    """
+    if selection_method == 'tournament':
+        return tournament_selection(scores, n_parents, rng, tournament_size)
+    elif selection_method == 'rank':
+        return rank_selection(scores, n_parents, rng)
+    elif selection_method == 'truncation':
+        return truncation_selection(scores, n_parents, rng, truncation_rate)
+    raise ValueError("Unknown selection method: " + str(selection_method))
+
+
+def tournament_selection(scores, n_parents, rng=None, tournament_size=3):
+    """
+    Takes :param tournament_size random individuals for each parent, the best one wins (the first one on ties)
+
+    :param scores:(np.ndarray) (P,) scores of the individuals
+    :param n_parents:(int) Number of parents needed
+    :param rng:(np.random.Generator) Random generator to use
+    :param tournament_size:(int) Number of contenders in each tournament
+    :return:(np.ndarray) (n_parents,) indices of the selected parents
+    """
+    rng = rng or np.random.default_rng()
+    contenders = rng.integers(0, len(scores), (n_parents, tournament_size))     # all tournaments at once
+    return contenders[np.arange(n_parents), np.argmax(scores[contenders], axis=1)]
+
+
+def rank_selection(scores, n_parents, rng=None):
+    """
+    Picks parents with a probability proportional to their rank (worst individual has rank 1)
+
+    :param scores:(np.ndarray) (P,) scores of the individuals
+    :param n_parents:(int) Number of parents needed
+    :param rng:(np.random.Generator) Random generator to use
+    :return:(np.ndarray) (n_parents,) indices of the selected parents
+    """
+    rng = rng or np.random.default_rng()
+    ranks = np.empty(len(scores))
+    ranks[np.argsort(scores, kind='stable')] = np.arange(1, len(scores) + 1)
+    return rng.choice(len(scores), n_parents, p=ranks / ranks.sum())
+
+
+def truncation_selection(scores, n_parents, rng=None, truncation_rate=0.5):
+    """
+    Picks parents uniformly among the best :param truncation_rate proportion of individuals
+
+    :param scores:(np.ndarray) (P,) scores of the individuals
+    :param n_parents:(int) Number of parents needed
+    :param rng:(np.random.Generator) Random generator to use
+    :param truncation_rate:(float) Proportion of best individuals parents are picked from
+    :return:(np.ndarray) (n_parents,) indices of the selected parents
+    """
+    rng = rng or np.random.default_rng()
+    best = np.argsort(-scores, kind='stable')[:max(1, int(truncation_rate * len(scores)))]
+    return best[rng.integers(0, len(best), n_parents)]
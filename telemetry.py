@@ -0,0 +1,120 @@
+# Valentin Macé
+# valentin.mace@kedgebs.com
+# Developed for fun
+# Feel free to use this code as you wish as long as you quote me as author
+
+"""
+telemetry.py
+~~~~~~~~~~
+
+A module to stream one record per generation (fitness, time spent in each stage, counts) to a JSON lines or CSV file,
+so that long runs can be monitored and compared without reading their console output
+
+Stages are also timed by the hierarchical timers of mlagents_envs, whose tree (stages, the functions they call,
+inference and env steps of games...) can be saved with save_timer_tree
+
+"""
+
+import contextlib
+import csv
+import json
+import time
+from mlagents_envs.timers import get_timer_tree, hierarchical_timer
+
+from writer import *
+
+
+class StageTimer:
+    """ Stage Timer class
+
+    Adds up the wall time spent in each named stage, use it as: with timer('selection'): ...
+    Totals are taken (and started again from zero) by reset, once per generation.
+    Each stage is also a hierarchical timer, so it appears in the timer tree with what it calls.
+
+    """
+
+    def __init__(self):
+        self.durations = {}         # stage name -> seconds spent since the last reset
+
+    @contextlib.contextmanager
+    def __call__(self, name):
+        start_time = time.perf_counter()
+        try:
+            with hierarchical_timer(name):
+                yield
+        finally:
+            self.durations[name] = self.durations.get(name, 0.0) + time.perf_counter() - start_time
+
+    def reset(self):
+        """
+        :return:(dict) Seconds spent in each stage since the last reset
+        """
+        durations, self.durations = self.durations, {}
+        return durations
+
+
+def save_timer_tree(path):
+    """
+    Writes the tree of the hierarchical timers of this process (total time, count and self time of every block) as
+    JSON, see writer.atomic_write
+
+    :param path:(str) JSON file
+    """
+    with atomic_write(path) as file:
+        json.dump(get_timer_tree(), file, indent=2)
+
+
+class TelemetryWriter(BackgroundWriter):
+    """ Telemetry Writer class
+
+    Writes records (flat dicts) on a background thread (see writer.BackgroundWriter). Each record is flushed as
+    soon as it is written, the file can be read while the run goes on.
+    The format follows the extension of the file: CSV for .csv (columns are the keys of the first record), JSON lines
+    otherwise.
+
+    """
+
+    def __init__(self, path, append=False):
+        """ Opens the file and starts the writing thread
+
+        :param path:(str) File where records are written
+        :param append:(bool) Adds records after existing ones (e.g. when a run is resumed) instead of replacing them
+        """
+        self.path = path
+        self.csv = path.endswith('.csv')
+        self.file = open(path, 'a' if append else 'w', newline='')
+        self.columns = None         # CSV columns, keys of the first record
+        self.writer = None
+        super().__init__()
+
+    def write(self, record):
+        """
+        Queues a record and returns without waiting for it to be written
+
+        :param record:(dict) Values must be JSON serializable
+        """
+        self.put(dict(record))
+
+    def write_item(self, record):
+        """
+        Writes and flushes a single record
+        """
+        if self.csv:
+            if self.writer is None:
+                self.columns = list(record)
+                self.writer = csv.DictWriter(self.file, self.columns, extrasaction='ignore')
+                if self.file.tell() == 0:       # no header yet
+                    self.writer.writeheader()
+            self.writer.writerow(record)
+        else:
+            self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def close(self):
+        """
+        Writes queued records and closes the file
+        """
+        try:
+            super().close()
+        finally:
+            self.file.close()
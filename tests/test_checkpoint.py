@@ -0,0 +1,54 @@
+import functools
+
+import numpy as np
+
+from checkpoint import load_checkpoint, save_checkpoint
+from genetic_algorithm import GeneticAlgorithm
+from mlagents_envs.ball_env import BallEnv
+
+ball_env_factory = functools.partial(BallEnv, n_agents=4, max_steps=30)
+
+
+def test_checkpoint_round_trip(tmp_path):
+    path = str(tmp_path / "state.ckpt")
+    rng = np.random.default_rng(3)
+    rng.random(5)
+    arrays = {'genomes': rng.standard_normal((7, 13)).astype(np.float32),
+              'scores': rng.standard_normal(7),
+              'stale': np.array([True, False, True, False, False, True, False]),
+              'counts': np.arange(5, dtype=np.int64),
+              'empty': np.zeros(0)}
+    metadata = {'generation': 4, 'rng': rng.bit_generator.state}
+    save_checkpoint(path, arrays, metadata)
+    expected = rng.random(3)
+    for mmap in (True, False):
+        loaded, loaded_metadata = load_checkpoint(path, mmap=mmap)
+        assert list(loaded) == list(arrays)
+        for name, array in arrays.items():
+            assert loaded[name].dtype == array.dtype and loaded[name].shape == array.shape
+            assert np.array_equal(loaded[name], array)
+        assert loaded_metadata['generation'] == 4
+        resumed = np.random.default_rng()
+        resumed.bit_generator.state = loaded_metadata['rng']
+        assert np.array_equal(resumed.random(3), expected)
+
+
+def test_resume_restores_state(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)             # best networks are saved in the working directory
+    parameters = dict(unity_env_name=None, networks_shape=[8, 6, 2], population_size=12, env_factory=ball_env_factory,
+                      seed=0, checkpoint_path=str(tmp_path / "ga.ckpt"), reevaluate_stale=True)
+    ga = GeneticAlgorithm(generation_number=2, **parameters)
+    ga.start()
+    ga.close()
+
+    resumed = GeneticAlgorithm(generation_number=3, **parameters)
+    resumed.resume()
+    assert resumed.generation == ga.generation == 2
+    assert np.array_equal(resumed.population.genomes, ga.population.genomes)
+    assert np.array_equal(resumed.population.scores, ga.population.scores)
+    assert np.array_equal(resumed.population.stale, ga.population.stale)
+    assert resumed.rng.bit_generator.state == ga.rng.bit_generator.state
+    assert resumed.generation_resets == ga.generation_resets
+    resumed.start()                         # checkpoints replace the file the run was resumed from
+    resumed.close()
+    assert load_checkpoint(parameters['checkpoint_path'])[1]['generation'] == 3
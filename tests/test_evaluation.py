@@ -0,0 +1,57 @@
+import functools
+
+import numpy as np
+import pytest
+
+from evaluation import EvaluationPool
+from mlagents_envs.ball_env import BallEnv
+from neural_network import PopulationTensor
+
+SHAPE = [8, 6, 2]
+ball_env_factory = functools.partial(BallEnv, n_agents=4, max_steps=30)
+
+
+def test_pool_evaluates_growing_populations():
+    rng = np.random.default_rng(0)
+    with EvaluationPool(ball_env_factory, 2) as pool:
+        small = PopulationTensor(SHAPE, 6, np.float32, rng)
+        scores = pool.evaluate(small, n_episodes=3, batch_size=4)
+        assert scores.shape == (6, 3)
+        # every game lasts at most max_steps steps, earning 0.1 per step or -1 when the ball falls
+        assert np.all(scores <= 30 * 0.1 + 1e-5) and np.all(scores >= -1.0)
+        capacity = len(pool.genomes.array)
+
+        large = PopulationTensor(SHAPE, 25, np.float32, rng)
+        scores = pool.evaluate(large, n_episodes=2, batch_size=4)
+        assert scores.shape == (25, 2)
+        assert len(pool.genomes.array) >= 25 > capacity       # shared blocks were reallocated
+        assert pool.tasks_done.sum() == 2 + 7                  # 2 batches (3 episodes split), then 7 batches
+        assert pool.steps > 0
+
+
+def test_pool_close_stops_workers():
+    pool = EvaluationPool(ball_env_factory, 2)
+    workers = list(pool.workers)
+    pool.evaluate(PopulationTensor(SHAPE, 4, np.float32), n_episodes=1, batch_size=4)
+    pool.close()
+    assert pool.workers == [] and pool.genomes is None
+    for worker in workers:
+        assert not worker.is_alive()
+        assert worker.exitcode == 0
+
+
+def test_pool_raises_when_workers_died():
+    with EvaluationPool(ball_env_factory, 2) as pool:
+        for worker in pool.workers:         # e.g. the Unity player crashed or was killed
+            worker.kill()
+            worker.join()
+        with pytest.raises(RuntimeError, match="died"):
+            pool.evaluate(PopulationTensor(SHAPE, 4, np.float32), n_episodes=1, batch_size=4)
+
+
+def test_pool_runs_fused_inference():
+    population = PopulationTensor(SHAPE, 6, np.float64, np.random.default_rng(1))
+    with EvaluationPool(ball_env_factory, 1) as pool:
+        expected = pool.evaluate(population, n_episodes=2, batch_size=4)
+    with EvaluationPool(ball_env_factory, 1, fused_inference=True) as pool:
+        assert np.allclose(pool.evaluate(population, n_episodes=2, batch_size=4), expected)
@@ -0,0 +1,20 @@
+import functools
+import os
+
+from evolution_strategies import EvolutionStrategies
+from mlagents_envs.ball_env import BallEnv
+
+ball_env_factory = functools.partial(BallEnv, n_agents=4, max_steps=30)
+
+
+def test_start_frees_shared_blocks(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)             # the network of each iteration is saved in the working directory
+    es = EvolutionStrategies(None, networks_shape=[8, 6, 2], population_size=8, iteration_number=2,
+                             noise_size=2**12, n_process=2, env_factory=ball_env_factory, seed=0)
+    names = [es.theta.shm.name, es.noise.shm.name]
+    es.start()
+    assert es.pool is None and es.theta is None and es.noise is None
+    if os.path.isdir('/dev/shm'):
+        assert not any(os.path.exists('/dev/shm/' + name.lstrip('/')) for name in names)
+    assert es.network().shape == [8, 6, 2]
+    es.close()                              # nothing left to free
@@ -0,0 +1,43 @@
+import numpy as np
+
+from evaluation import FitnessCache
+
+
+def test_cache_counts_hits_and_misses():
+    cache = FitnessCache(max_size=10)
+    genomes = np.arange(12, dtype=np.float32).reshape(3, 4)
+    keys = cache.keys(genomes)
+    scores, missing = cache.lookup(keys)
+    assert np.all(np.isnan(scores)) and np.all(missing)
+    cache.store(keys, np.array([1.0, 2.0, 3.0]))
+
+    scores, missing = cache.lookup(cache.keys(genomes.copy()))     # keys depend on the content only
+    assert np.array_equal(scores, [1.0, 2.0, 3.0]) and not np.any(missing)
+    assert (cache.hits, cache.misses, cache.resamples) == (3, 3, 0)
+    assert cache.hit_rate() == 0.5
+
+    cache.set_seeds((1, 2))             # scores obtained with other seeds are not reused
+    assert np.all(cache.lookup(cache.keys(genomes))[1])
+
+
+def test_cache_evicts_least_recently_used():
+    cache = FitnessCache(max_size=3)
+    keys = cache.keys(np.arange(4, dtype=np.float64).reshape(4, 1))
+    cache.store(keys[:3], np.array([0.0, 1.0, 2.0]))
+    cache.lookup(keys[:1])              # genome 0 becomes the most recently used
+    cache.store(keys[3:], np.array([3.0]))
+    assert len(cache) == 3
+    assert list(cache.entries) == [keys[2], keys[0], keys[3]]      # genome 1 was evicted
+    assert cache.lookup(keys[1:2])[1][0]
+
+
+def test_cache_averages_resampled_scores():
+    cache = FitnessCache(resample_rate=1.0, rng=np.random.default_rng(0))
+    keys = cache.keys(np.ones((2, 3)) * [[1], [2]])
+    cache.store(keys, np.array([1.0, 4.0]))
+    scores, missing = cache.lookup(keys)
+    assert np.array_equal(scores, [1.0, 4.0]) and np.all(missing)     # cached scores are kept until re-evaluated
+    assert cache.resamples == 2 and cache.hits == 0
+    assert np.array_equal(cache.store(keys, np.array([3.0, 2.0])), [2.0, 3.0])
+    assert np.array_equal(cache.store(keys, np.array([5.0, 6.0])), [3.0, 4.0])
+    assert cache.entries[keys[0]] == (3.0, 3)
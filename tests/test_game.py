@@ -0,0 +1,17 @@
+import gc
+import weakref
+
+from game import Game
+from mlagents_envs.ball_env import BallEnv
+
+
+def test_session_is_freed_with_its_env():
+    env = BallEnv(n_agents=2, max_steps=5)
+    game = Game.session(env)
+    game.fused_inference = True
+    assert Game.session(env, time_scale=100.0) is game and game.fused_inference     # setting kept
+    env.close()
+    env_ref, game_ref = weakref.ref(env), weakref.ref(game)
+    del env, game
+    gc.collect()
+    assert env_ref() is None and game_ref() is None
@@ -0,0 +1,35 @@
+import os
+
+import numpy as np
+import pytest
+
+from island import IslandModel
+from mlagents_envs.ball_env import BallEnv
+
+
+def ball_env_factory(worker_id=0, seed=0):
+    return BallEnv(n_agents=4, max_steps=30, worker_id=worker_id, seed=seed)
+
+
+def dying_env_factory(worker_id=0, seed=0):
+    if worker_id == 12:         # main env of island 1 (10 + 1 * (n_process + 1)), the process is killed without posting a result
+        os._exit(3)
+    return ball_env_factory(worker_id, seed)
+
+
+def test_islands_keep_caller_prefix(tmp_path):
+    model = IslandModel(n_islands=2, migration_interval=1, migration_size=2, seed=0, unity_env_name=None,
+                        networks_shape=[8, 6, 2], population_size=8, generation_number=2,
+                        env_factory=ball_env_factory, save_prefix=str(tmp_path / "best_"))
+    population = model.start()
+    assert len(population) == 16 and np.all(np.diff(population.scores) <= 0)
+    for i in range(2):
+        assert (tmp_path / ("island" + str(i) + "_best_2_weights.npy")).exists()
+
+
+def test_islands_raise_when_an_island_died(tmp_path):
+    model = IslandModel(n_islands=2, seed=0, unity_env_name=None, networks_shape=[8, 6, 2], population_size=8,
+                        generation_number=2, env_factory=dying_env_factory, env_worker_id=10,
+                        save_prefix=str(tmp_path / "gen_"))
+    with pytest.raises(RuntimeError, match="Island 1 died, exit code 3"):
+        model.start()
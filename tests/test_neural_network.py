@@ -0,0 +1,12 @@
+import numpy as np
+
+from neural_network import sigmoid
+
+
+def test_sigmoid_accepts_scalars_and_keeps_precision():
+    assert np.isclose(sigmoid(0.5), 1.0 / (1.0 + np.exp(-0.5)))
+    assert isinstance(sigmoid(np.float32(0.5)), np.float32)
+    z = np.linspace(-3, 3, 7, dtype=np.float32).reshape(7, 1)
+    a = sigmoid(z)
+    assert a.dtype == np.float32 and a.shape == (7, 1)
+    assert np.allclose(a, 1.0 / (1.0 + np.exp(-z.astype(np.float64))), atol=1e-6)
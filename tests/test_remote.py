@@ -0,0 +1,81 @@
+import functools
+import multiprocessing as mp
+import os
+import socket
+import time
+
+import numpy as np
+import pytest
+
+from mlagents_envs.ball_env import BallEnv
+from neural_network import PopulationTensor
+from remote import EvaluationServer, EvaluationWorker
+
+SHAPE = [8, 6, 2]
+ball_env_factory = functools.partial(BallEnv, n_agents=4, max_steps=30)
+
+
+def run_worker(port, worker_id, crash=False):
+    worker = EvaluationWorker(ball_env_factory, port=port, worker_id=worker_id, heartbeat_interval=0.2)
+    if crash:           # dies in the middle of its first batch
+        def play(*args, **kwargs):
+            os._exit(1)
+        worker.game.play = play
+    try:
+        worker.run()
+    finally:
+        worker.close()
+
+
+def wait_for_workers(server, n, timeout=30.0):
+    deadline = time.time() + timeout
+    while len(server.workers) < n:
+        assert time.time() < deadline, "workers did not register"
+        time.sleep(0.05)
+
+
+def test_server_plays_batches_on_workers():
+    with EvaluationServer('127.0.0.1', 0, heartbeat_timeout=5.0) as server:
+        workers = [mp.Process(target=run_worker, args=(server.address[1], i)) for i in (1, 2)]
+        for worker in workers:
+            worker.start()
+        wait_for_workers(server, 2)
+        scores = server.evaluate(PopulationTensor(SHAPE, 10, np.float32), n_episodes=2, batch_size=4)
+        assert scores.shape == (10, 2)
+        assert np.all(scores <= 30 * 0.1 + 1e-5) and np.all(scores >= -1.0)
+        assert server.requeued == 0 and server.steps > 0
+    for worker in workers:      # closing the server stops its workers
+        worker.join(10)
+        assert worker.exitcode == 0
+
+
+def test_server_requeues_batch_of_lost_worker():
+    with EvaluationServer('127.0.0.1', 0, heartbeat_timeout=5.0) as server:
+        crashing = mp.Process(target=run_worker, args=(server.address[1], 1, True))
+        healthy = mp.Process(target=run_worker, args=(server.address[1], 2))
+        crashing.start()
+        wait_for_workers(server, 1)
+        healthy.start()
+        wait_for_workers(server, 2)
+        scores = server.evaluate(PopulationTensor(SHAPE, 24, np.float32), n_episodes=1, batch_size=4)
+        assert scores.shape == (24, 1)
+        assert server.requeued >= 1
+        assert list(server.workers) == [socket.gethostname() + ":2"]      # the lost worker was dropped
+    crashing.join(10)
+    healthy.join(10)
+    assert crashing.exitcode == 1 and healthy.exitcode == 0
+
+
+
+def test_server_raises_failure_of_batch():
+    with EvaluationServer('127.0.0.1', 0, heartbeat_timeout=5.0) as server:
+        worker = mp.Process(target=run_worker, args=(server.address[1], 1))
+        worker.start()
+        wait_for_workers(server, 1)
+        with pytest.raises(RuntimeError, match="Evaluation worker failed"):      # inputs do not match the env
+            server.evaluate(PopulationTensor([5, 6, 2], 8, np.float32), n_episodes=1, batch_size=4)
+        scores = server.evaluate(PopulationTensor(SHAPE, 8, np.float32), n_episodes=1, batch_size=4)
+        assert scores.shape == (8, 1) and server.requeued == 0
+        assert list(server.workers) == [socket.gethostname() + ":1"]      # the worker is still there
+    worker.join(10)
+    assert worker.exitcode == 0
@@ -0,0 +1,53 @@
+import threading
+
+import pytest
+
+from writer import BackgroundWriter, atomic_write
+
+
+class ListWriter(BackgroundWriter):
+
+    def __init__(self, keep_latest=False):
+        self.items = []
+        self.gate = threading.Event()       # holds the first write, so that later items wait
+        super().__init__(keep_latest)
+
+    def write_item(self, item):
+        self.gate.wait()
+        if item == 'fail':
+            raise ValueError(item)
+        self.items.append(item)
+
+
+def test_background_writer_keeps_order_or_latest():
+    for keep_latest, expected in ((False, [0, 1, 2, 3]), (True, [0, 3])):
+        writer = ListWriter(keep_latest)
+        for item in range(4):
+            writer.put(item)
+        writer.gate.set()
+        writer.close()
+        assert writer.items == expected or (keep_latest and writer.items == [3])
+
+
+def test_background_writer_raises_write_errors():
+    writer = ListWriter()
+    writer.gate.set()
+    writer.put('fail')
+    with pytest.raises(ValueError):
+        writer.flush()
+    writer.put('ok')
+    writer.close()
+    assert writer.items == ['ok']
+    with pytest.raises(TypeError):          # write_item is abstract
+        BackgroundWriter()
+
+
+def test_atomic_write_keeps_previous_file_on_failure(tmp_path):
+    path = str(tmp_path / "file.json")
+    with atomic_write(path) as file:
+        file.write("first")
+    with pytest.raises(RuntimeError):
+        with atomic_write(path) as file:
+            file.write("partial")
+            raise RuntimeError
+    assert open(path).read() == "first"
@@ -32,7 +32,8 @@ if __name__ == '__main__':
     
     You might want to use multi-processing, but note that it is still an early version that might not work properly
     Use multiprocessing.cpu_count() to count available cores
+    float32 networks match the observations sent by the env and take half the memory
     """
     gen = GeneticAlgorithm(unity_env_name=multiple_agents_env_name, networks_shape=[8,16,2], population_size=100,
-                           crossover_method='neuron', mutation_method='weight', n_process=1)
+                           crossover_method='neuron', mutation_method='weight', n_process=1, dtype=np.float32)
     gen.start()
@@ -0,0 +1,124 @@
+# Valentin Macé
+# valentin.mace@kedgebs.com
+# Developed for fun
+# Feel free to use this code as you wish as long as you quote me as author
+
+"""
+writer.py
+~~~~~~~~~~
+
+A module to write files without slowing down or corrupting a run: atomic_write never leaves a partially written file
+behind, a BackgroundWriter takes the writes off the main thread (see checkpoint and telemetry)
+
+"""
+
+import abc
+import collections
+import contextlib
+import os
+import threading
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode='w'):
+    """
+    Opens a temporary file that replaces :param path only once complete and synced to disk, so that a reader (or a
+    resumed run) never sees a partially written file, use it as: with atomic_write(path) as file: ...
+
+    :param path:(str) File to write
+    :param mode:(str) Mode of open, 'w' or 'wb'
+    """
+    temporary = path + '.tmp'
+    with open(temporary, mode) as file:
+        yield file
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+
+class BackgroundWriter(abc.ABC):
+    """ Background Writer class
+
+    Writes items on a background thread, so that a generation never waits for the disk. Subclasses implement
+    write_item. Items are written in order, or with keep_latest, an item still waiting when another one is put is
+    dropped (only the latest state matters).
+    An exception raised by write_item is raised again by the next flush or close.
+
+    """
+
+    def __init__(self, keep_latest=False):
+        """ Starts the writing thread
+
+        :param keep_latest:(bool) Only writes the latest of the items waiting
+        """
+        self.keep_latest = keep_latest
+        self.condition = threading.Condition()
+        self.pending = collections.deque()      # items waiting to be written
+        self.writing = False
+        self.closed = False         # the thread stops once pending items are written
+        self.error = None           # exception raised by the last write, raised again by flush
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, item):
+        """
+        Queues an item and returns without waiting for it to be written
+        """
+        with self.condition:
+            if self.keep_latest:
+                self.pending.clear()
+            self.pending.append(item)
+            self.condition.notify_all()
+
+    def run(self):
+        """
+        Loop of the background thread
+        """
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                item = self.pending.popleft()
+                self.writing = True
+            try:
+                self.write_item(item)
+            except Exception as error:
+                self.error = error
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+    @abc.abstractmethod
+    def write_item(self, item):
+        """
+        Writes a single item, called on the background thread
+        """
+
+    def raise_error(self):
+        """
+        Raises the exception of the last failed write, if any
+        """
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def flush(self):
+        """
+        Waits until queued items are written
+        """
+        with self.condition:
+            while self.pending or self.writing:
+                self.condition.wait()
+        self.raise_error()
+
+    def close(self):
+        """
+        Writes queued items and stops the thread
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.raise_error()